@@ -0,0 +1,203 @@
+"""
+Live chat storage primitives backed by MongoDB collections.
+
+SequenceAllocator hands out per-community message sequence numbers, and
+ChatBucketStore keeps chat history in fixed-size bucket documents. Both take the
+(Motor) collection they work on, so the app wires them to its database.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+LEGACY_BUCKET_BASE = -1_000_000
+
+class SequenceAllocator:
+    """Per-key monotonically increasing sequence numbers backed by MongoDB.
+
+    Each number comes from one atomic $inc on the key's counter document, so every
+    worker draws from the same sequence. `block_size` > 1 reserves that many numbers per round trip
+    and hands them out from memory; that is only safe with a single worker, since
+    concurrent workers would interleave their blocks (one serving 1-100 while another
+    serves 101-200) and a client resuming from the higher block would skip the lower
+    one. Unused numbers of a block are skipped after a restart, so sequences may have
+    gaps but never repeat or go backwards.
+    """
+
+    def __init__(self, collection, block_size: int = 1):
+        self.collection = collection
+        self.block_size = block_size
+        self.blocks: Dict[str, List[int]] = {}  # key -> [next, end)
+        self.locks: Dict[str, asyncio.Lock] = {}
+
+    def _take(self, key: str) -> Optional[int]:
+        block = self.blocks.get(key)
+        if block and block[0] < block[1]:
+            block[0] += 1
+            return block[0] - 1
+        return None
+
+    async def next(self, key: str) -> int:
+        seq = self._take(key)
+        if seq is not None:
+            return seq
+        
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            seq = self._take(key)
+            if seq is not None:
+                return seq
+            counter = await self.collection.find_one_and_update(
+                {"_id": key},
+                {"$inc": {"value": self.block_size}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            end = counter["value"] + 1
+            self.blocks[key] = [end - self.block_size, end]
+            return self._take(key)
+
+class ChatBucketStore:
+    """Live chat history grouped into fixed-size bucket documents per community.
+
+    A message with sequence number `seq` lives in bucket `seq // size` of its community and
+    is added with an upserting $push that keeps the bucket ordered by seq, so the latest N
+    messages (N <= size) span at most two buckets: reading recent history is one indexed
+    query returning two documents no matter how long the history is. Messages stored before
+    sequence numbers existed (seq 0) go into hourly buckets numbered below zero, which sort
+    ahead of every sequenced bucket.
+    """
+
+    def __init__(self, collection, size: int = 200):
+        self.collection = collection
+        self.size = size
+
+    def bucket_of(self, msg: dict) -> int:
+        if msg.get("seq"):
+            return msg["seq"] // self.size
+        created_at = msg["created_at"]
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        return LEGACY_BUCKET_BASE + int(created_at.timestamp() // 3600)
+
+    def _push(self, msg: dict) -> dict:
+        msg = {"seq": 0, **{key: value for key, value in msg.items() if key != "_id"}}
+        return {
+            "$push": {"messages": {"$each": [msg], "$sort": {"seq": 1, "created_at": 1}}},
+            "$inc": {"count": 1},
+            "$min": {"first_at": msg["created_at"]},
+            "$max": {"last_at": msg["created_at"]}
+        }
+
+    async def append(self, msg: dict):
+        """Add a message to its bucket, creating the bucket on first write; repeats are ignored"""
+        bucket = self.bucket_of(msg)
+        update = self._push(msg)
+        update["$setOnInsert"] = {"community_id": msg["community_id"], "bucket": bucket}
+        for _ in range(2):
+            try:
+                await self.collection.update_one(
+                    {"_id": f"{msg['community_id']}:{bucket}", "messages.id": {"$ne": msg["id"]}},
+                    update,
+                    upsert=True
+                )
+                return
+            except DuplicateKeyError:
+                # Either the bucket was created concurrently (retry pushes into it) or it
+                # already holds this message (the retry fails the same way and we stop)
+                continue
+
+    async def add_many(self, messages: List[dict]):
+        """Bulk-add stored messages, skipping any a bucket already holds"""
+        shells, pushes = {}, []
+        for msg in messages:
+            bucket = self.bucket_of(msg)
+            bucket_id = f"{msg['community_id']}:{bucket}"
+            shells[bucket_id] = UpdateOne(
+                {"_id": bucket_id},
+                {"$setOnInsert": {"community_id": msg["community_id"], "bucket": bucket, "messages": [], "count": 0}},
+                upsert=True
+            )
+            pushes.append(UpdateOne({"_id": bucket_id, "messages.id": {"$ne": msg["id"]}}, self._push(msg)))
+        if pushes:
+            await self.collection.bulk_write(list(shells.values()), ordered=False)
+            await self.collection.bulk_write(pushes)
+
+    async def latest(self, community_id: str, limit: int) -> List[dict]:
+        """Return the latest `limit` messages in chronological order"""
+        per_query = -(-limit // self.size) + 1
+        messages: List[dict] = []
+        query: Dict[str, Any] = {"community_id": community_id}
+        while len(messages) < limit:
+            buckets = await self.collection.find(
+                query, {"bucket": 1, "messages": 1}
+            ).sort("bucket", -1).limit(per_query).to_list(length=None)
+            messages = [msg for bucket in reversed(buckets) for msg in bucket["messages"]] + messages
+            if len(buckets) < per_query:
+                break
+            query = {"community_id": community_id, "bucket": {"$lt": buckets[-1]["bucket"]}}
+        return messages[-limit:] if limit > 0 else []
+
+    async def since(self, community_id: str, last_seq: int, limit: int) -> List[dict]:
+        """Return up to `limit` messages with a sequence number above `last_seq`"""
+        messages: List[dict] = []
+        cursor = self.collection.find(
+            {"community_id": community_id, "bucket": {"$gte": (last_seq + 1) // self.size}}, {"messages": 1}
+        ).sort("bucket", 1)
+        async for bucket in cursor:
+            messages.extend(msg for msg in bucket["messages"] if msg.get("seq", 0) > last_seq)
+            if len(messages) >= limit:
+                break
+        return messages[:limit]
+
+    async def iter_latest(self, community_id: str, limit: int):
+        """Yield the latest `limit` messages in chronological order, one bucket at a time"""
+        start_bucket, skip, total = None, 0, 0
+        async for bucket in self.collection.find({"community_id": community_id}, {"bucket": 1, "count": 1}).sort("bucket", -1):
+            start_bucket = bucket["bucket"]
+            total += bucket.get("count", 0)
+            if total >= limit:
+                skip = total - limit
+                break
+        if start_bucket is None:
+            return
+        async for msg in self.iter_messages(community_id, start_bucket):
+            if skip:
+                skip -= 1
+                continue
+            yield msg
+
+    async def iter_messages(self, community_id: str, from_bucket: Optional[int] = None):
+        """Yield every message of a community in chronological order"""
+        query: Dict[str, Any] = {"community_id": community_id}
+        if from_bucket is not None:
+            query["bucket"] = {"$gte": from_bucket}
+        async for bucket in self.collection.find(query, {"messages": 1}).sort("bucket", 1).batch_size(4):
+            for msg in bucket["messages"]:
+                yield msg
+
+    async def count_since(self, community_id: str, since: str) -> int:
+        """Number of messages created at or after `since`"""
+        result = await self.collection.aggregate([
+            {"$match": {"community_id": community_id, "last_at": {"$gte": since}}},
+            {"$unwind": "$messages"},
+            {"$match": {"messages.created_at": {"$gte": since}}},
+            {"$count": "count"}
+        ]).to_list(length=None)
+        return result[0]["count"] if result else 0
+
+    async def changed_since(self, community_ids: List[str], since: str, limit: int) -> List[dict]:
+        """Messages created at or after `since`, oldest first - only buckets written since then are read"""
+        return await self.collection.aggregate([
+            {"$match": {"community_id": {"$in": community_ids}, "last_at": {"$gte": since}}},
+            {"$unwind": "$messages"},
+            {"$replaceRoot": {"newRoot": "$messages"}},
+            {"$match": {"created_at": {"$gte": since}}},
+            {"$sort": {"created_at": 1}},
+            {"$limit": limit}
+        ]).to_list(length=None)
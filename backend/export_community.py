@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Circle of Care - Community bulk export
+Streams a community's posts and live chat history as NDJSON
+
+Usage: python export_community.py <community_id> [output_file]
+"""
+
+import asyncio
+import sys
+
+from server import client, iter_community_export
+
+async def export_community(community_id: str, output_path: str = None) -> int:
+    """Write the export to `output_path` (or stdout) and return the number of records"""
+    out = open(output_path, "w", encoding="utf-8") if output_path else sys.stdout
+    count = 0
+    try:
+        async for line in iter_community_export(community_id):
+            out.write(line)
+            count += 1
+    finally:
+        if output_path:
+            out.close()
+        client.close()
+    return count
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip(), file=sys.stderr)
+        return 1
+
+    output_path = sys.argv[2] if len(sys.argv) > 2 else None
+    count = asyncio.run(export_community(sys.argv[1], output_path))
+    print(f"Exported {count} records for community {sys.argv[1]}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
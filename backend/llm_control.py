@@ -0,0 +1,230 @@
+"""
+Admission control for LLM provider calls.
+
+CircuitBreaker stops calling a failing or slow provider so callers serve their
+fallbacks, and LLMScheduler decides which queued call gets the next free slot.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+class LLMUnavailableError(Exception):
+    """Raised instead of calling the provider while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker driven by the rolling error and slow-call rates.
+
+    While closed, calls are recorded in a sliding time window; once enough calls have
+    been seen and either the failure rate or the share of slow calls crosses its
+    threshold, the breaker opens and calls are rejected
+    immediately. After `cooldown_seconds` a few trial calls are let through (half-open):
+    a healthy trial closes the breaker again, a failed or slow one reopens it. A call is
+    slow past the threshold its caller passes to `record` - call sites with different
+    latency budgets share one breaker - or `slow_call_seconds` when none is given.
+    """
+
+    def __init__(self, window_seconds: float = 60, min_calls: int = 10, error_rate: float = 0.5,
+                 slow_call_seconds: float = 8.0, slow_rate: float = 0.5, cooldown_seconds: float = 30,
+                 half_open_max_calls: int = 2):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.cooldown_seconds = cooldown_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.trial_calls = 0
+        self.calls: deque = deque()  # (finished_at, ok, slow)
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _prune(self, now: float):
+        while self.calls and self.calls[0][0] < now - self.window_seconds:
+            self.calls.popleft()
+
+    def _rates(self):
+        total = len(self.calls)
+        if not total:
+            return 0.0, 0.0
+        failures = sum(1 for _, ok, _ in self.calls if not ok)
+        slow = sum(1 for _, _, is_slow in self.calls if is_slow)
+        return failures / total, slow / total
+
+    def _open(self, now: float):
+        self.state = "open"
+        self.opened_at = now
+        self.trial_calls = 0
+        self.times_opened += 1
+        logging.warning("LLM circuit breaker opened - serving fallback responses")
+
+    def allow(self) -> bool:
+        """Return True if a call may go to the provider (reserving a trial slot when half-open)"""
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.cooldown_seconds:
+            self.state = "half_open"
+            self.trial_calls = 0
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and self.trial_calls < self.half_open_max_calls:
+            self.trial_calls += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, ok: bool, latency: float, slow_call_seconds: Optional[float] = None):
+        now = time.monotonic()
+        slow = latency > (slow_call_seconds if slow_call_seconds is not None else self.slow_call_seconds)
+        if self.state == "half_open":
+            self.trial_calls = max(0, self.trial_calls - 1)
+            if ok and not slow:
+                self.state = "closed"
+                self.calls.clear()
+                logging.info("LLM circuit breaker closed - provider recovered")
+            else:
+                self._open(now)
+            return
+        if self.state == "open":
+            return
+        
+        self.calls.append((now, ok, slow))
+        self._prune(now)
+        if len(self.calls) >= self.min_calls:
+            error_rate, slow_rate = self._rates()
+            if error_rate >= self.error_rate or slow_rate >= self.slow_rate:
+                self._open(now)
+
+    def release(self):
+        """Give back a half-open trial slot for a call that was cancelled before finishing"""
+        if self.state == "half_open":
+            self.trial_calls = max(0, self.trial_calls - 1)
+
+    def snapshot(self) -> dict:
+        self._prune(time.monotonic())
+        error_rate, slow_rate = self._rates()
+        return {
+            "state": self.state,
+            "window_calls": len(self.calls),
+            "error_rate": round(error_rate, 3),
+            "slow_rate": round(slow_rate, 3),
+            "times_opened": self.times_opened,
+            "rejected_calls": self.rejected
+        }
+
+class LLMDeadlineExceeded(asyncio.TimeoutError):
+    """Raised when a queued LLM call can no longer finish before its deadline"""
+
+class LLMScheduler:
+    """Priority-aware admission control for LLM calls.
+
+    Calls are grouped into priority classes (panic > companion > moderation), each
+    with its own concurrency limit under a global cap. Lower classes have limits below
+    the global cap, which leaves headroom for crisis traffic. When a slot frees up the
+    highest-priority class with queued work is served first, and inside a class users
+    are served round-robin so one busy user cannot starve the rest. Work whose
+    deadline leaves less than `min_call_seconds` is dropped instead of dispatched.
+    """
+
+    PRIORITIES = ("panic", "companion", "moderation")
+
+    def __init__(self, max_concurrency: int, class_limits: Dict[str, int], min_call_seconds: float = 1.0):
+        self.max_concurrency = max_concurrency
+        self.class_limits = class_limits
+        self.min_call_seconds = min_call_seconds
+        self.total_running = 0
+        self.running = {priority: 0 for priority in self.PRIORITIES}
+        self.queues: Dict[str, "OrderedDict[str, deque]"] = {priority: OrderedDict() for priority in self.PRIORITIES}
+        self.stats = {
+            priority: {"dispatched": 0, "dropped": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for priority in self.PRIORITIES
+        }
+
+    def _has_capacity(self, priority: str) -> bool:
+        return self.total_running < self.max_concurrency and self.running[priority] < self.class_limits[priority]
+
+    def _start(self, priority: str, waited: float):
+        self.total_running += 1
+        self.running[priority] += 1
+        stats = self.stats[priority]
+        stats["dispatched"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+
+    def _remove(self, priority: str, user_id: str, waiter: dict):
+        waiters = self.queues[priority].get(user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self.queues[priority][user_id]
+
+    def _dispatch(self):
+        now = time.monotonic()
+        for priority in self.PRIORITIES:
+            queue = self.queues[priority]
+            while queue and self._has_capacity(priority):
+                user_id, waiters = next(iter(queue.items()))
+                waiter = waiters.popleft()
+                # Round-robin: a user with more queued work goes to the back of the line
+                if waiters:
+                    queue.move_to_end(user_id)
+                else:
+                    del queue[user_id]
+                
+                if waiter["future"].done():
+                    continue
+                if waiter["deadline"] - now < self.min_call_seconds:
+                    self.stats[priority]["dropped"] += 1
+                    waiter["future"].set_exception(LLMDeadlineExceeded(f"{priority} LLM call dropped - deadline too close"))
+                    continue
+                self._start(priority, now - waiter["enqueued_at"])
+                waiter["future"].set_result(None)
+
+    async def acquire(self, priority: str, user_id: str, deadline: float):
+        """Wait for a slot in `priority`; raises LLMDeadlineExceeded if the deadline passes first"""
+        now = time.monotonic()
+        if not self.queues[priority] and self._has_capacity(priority):
+            self._start(priority, 0.0)
+            return
+        
+        waiter = {"future": asyncio.get_running_loop().create_future(), "deadline": deadline, "enqueued_at": now}
+        self.queues[priority].setdefault(user_id, deque()).append(waiter)
+        future = waiter["future"]
+        try:
+            await asyncio.wait({future}, timeout=max(0.0, deadline - now))
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release(priority)
+            else:
+                self._remove(priority, user_id, waiter)
+                future.cancel()
+            raise
+        
+        if not future.done():
+            self._remove(priority, user_id, waiter)
+            future.cancel()
+            self.stats[priority]["dropped"] += 1
+            raise LLMDeadlineExceeded(f"{priority} LLM call timed out in queue")
+        future.result()
+
+    def release(self, priority: str):
+        self.total_running -= 1
+        self.running[priority] -= 1
+        self._dispatch()
+
+    def snapshot(self) -> dict:
+        result = {}
+        for priority in self.PRIORITIES:
+            stats = self.stats[priority]
+            result[priority] = {
+                "running": self.running[priority],
+                "queued": sum(len(waiters) for waiters in self.queues[priority].values()),
+                "dispatched": stats["dispatched"],
+                "dropped": stats["dropped"],
+                "avg_queue_wait_ms": round(stats["wait_total"] / stats["dispatched"] * 1000, 1) if stats["dispatched"] else 0.0,
+                "max_queue_wait_ms": round(stats["wait_max"] * 1000, 1)
+            }
+        return result
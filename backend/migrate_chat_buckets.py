@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Circle of Care - Live chat bucket migration
+Copies per-message live_chat documents into live_chat_buckets
+
+Run while the API serves with CHAT_STORAGE=dual, then switch to CHAT_STORAGE=buckets.
+The migration is checkpointed and can be interrupted and re-run safely.
+
+Usage: python migrate_chat_buckets.py [batch_size]
+"""
+
+import asyncio
+import sys
+
+from server import CHAT_STORAGE, client, db, migrate_live_chat_to_buckets
+
+async def migrate(batch_size: int) -> int:
+    try:
+        await db.live_chat_buckets.create_index([("community_id", 1), ("bucket", 1)])
+        await db.live_chat_buckets.create_index([("community_id", 1), ("last_at", 1)])
+        return await migrate_live_chat_to_buckets(batch_size)
+    finally:
+        client.close()
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    if CHAT_STORAGE == 'messages':
+        print("⚠️  CHAT_STORAGE=messages - new messages are not being written to buckets; "
+              "run the API with CHAT_STORAGE=dual while migrating", file=sys.stderr)
+
+    copied = asyncio.run(migrate(batch_size))
+    print(f"Copied {copied} live chat messages into buckets", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
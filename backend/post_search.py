@@ -0,0 +1,142 @@
+"""
+In-process inverted index for community post search.
+
+Posts are indexed incrementally as they are created and ranked with BM25 over the
+title (weighted) and content. Postings are stored in compact arrays keyed by an
+integer document position, so memory stays close to the size of the postings
+themselves rather than one Python object per (term, post) pair.
+"""
+
+import heapq
+import math
+import re
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in into is it its me my of on or "
+    "so that the their them then there these they this to was we were what when which who "
+    "will with you your".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+class PostSearchIndex:
+    """BM25 inverted index over posts with community and support_type filters"""
+
+    TITLE_WEIGHT = 3
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, max_postings_per_term: int = 100_000):
+        self.k1 = k1
+        self.b = b
+        self.max_postings_per_term = max_postings_per_term
+        self.post_ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.lengths = array("I")
+        self.communities = array("I")
+        self.support_types = array("B")
+        self.alive = bytearray()
+        self.community_ids: Dict[str, int] = {}
+        self.support_type_ids: Dict[str, int] = {}
+        self.postings: Dict[str, Tuple[array, array]] = {}  # term -> (positions, term frequencies)
+        self.total_length = 0
+        self.live_count = 0
+
+    @staticmethod
+    def _intern(table: Dict[str, int], value: str) -> int:
+        return table.setdefault(value, len(table))
+
+    def add(self, post: dict):
+        """Index a post document (flagged posts and repeats are ignored)"""
+        if post.get("is_flagged") or post["id"] in self.positions:
+            return
+
+        counts: Dict[str, int] = {}
+        for token in tokenize(post.get("title", "")):
+            counts[token] = counts.get(token, 0) + self.TITLE_WEIGHT
+        for token in tokenize(post.get("content", "")):
+            counts[token] = counts.get(token, 0) + 1
+        length = sum(counts.values())
+
+        position = len(self.post_ids)
+        self.post_ids.append(post["id"])
+        self.positions[post["id"]] = position
+        self.lengths.append(length)
+        self.communities.append(self._intern(self.community_ids, post.get("community_id", "")))
+        self.support_types.append(self._intern(self.support_type_ids, post.get("support_type", "general")))
+        self.alive.append(1)
+        self.total_length += length
+        self.live_count += 1
+
+        for token, count in counts.items():
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = (array("I"), array("H"))
+            postings[0].append(position)
+            postings[1].append(min(count, 65535))
+
+    def remove(self, post_id: str):
+        """Hide a post from results, e.g. once it is flagged"""
+        position = self.positions.get(post_id)
+        if position is not None and self.alive[position]:
+            self.alive[position] = 0
+            self.live_count -= 1
+            self.total_length -= self.lengths[position]
+
+    def search(self, query: str, community_id: Optional[str] = None, support_type: Optional[str] = None,
+               limit: int = 20, after: Optional[Tuple[float, int]] = None) -> Tuple[List[Tuple[str, float]], Optional[Tuple[float, int]]]:
+        """Return up to `limit` (post_id, score) pairs and the cursor for the next page.
+
+        Results are ordered by descending score, ties broken by index position; `after`
+        is the cursor returned by the previous page. For very common terms only the newest
+        `max_postings_per_term` posts are scored, which bounds the cost of a query.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.live_count:
+            return [], None
+
+        community = self.community_ids.get(community_id) if community_id else None
+        support = self.support_type_ids.get(support_type) if support_type else None
+        if (community_id and community is None) or (support_type and support is None):
+            return [], None
+
+        k1, b = self.k1, self.b
+        avg_length = self.total_length / self.live_count
+        alive, lengths, communities, support_types = self.alive, self.lengths, self.communities, self.support_types
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            positions, frequencies = postings
+            idf = math.log(1 + (self.live_count - len(positions) + 0.5) / (len(positions) + 0.5))
+            if len(positions) > self.max_postings_per_term:
+                positions = positions[-self.max_postings_per_term:]
+                frequencies = frequencies[-self.max_postings_per_term:]
+            for position, tf in zip(positions, frequencies):
+                if not alive[position]:
+                    continue
+                if community is not None and communities[position] != community:
+                    continue
+                if support is not None and support_types[position] != support:
+                    continue
+                norm = k1 * (1 - b + b * lengths[position] / avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        candidates = ((-score, position) for position, score in scores.items())
+        if after is not None:
+            boundary = (-after[0], after[1])
+            candidates = (candidate for candidate in candidates if candidate > boundary)
+        top = heapq.nsmallest(limit + 1, candidates)
+        page = top[:limit]
+        results = [(self.post_ids[position], -neg_score) for neg_score, position in page]
+        next_cursor = (-page[-1][0], page[-1][1]) if len(top) > limit else None
+        return results, next_cursor
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the array-backed storage (postings and per-post columns)"""
+        arrays = sum(p.buffer_info()[1] * p.itemsize + f.buffer_info()[1] * f.itemsize for p, f in self.postings.values())
+        columns = sum(a.buffer_info()[1] * a.itemsize for a in (self.lengths, self.communities, self.support_types)) + len(self.alive)
+        return arrays + columns
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Circle of Care - Data retention
+Reports (default) or applies the retention policies for live chat, AI chat history
+and moderation reports. Expired documents are archived to gzipped NDJSON under
+ARCHIVE_DIR/<collection>/<YYYY-MM-DD>/ and then deleted in small chunks.
+
+Usage: python retention.py [--apply]
+"""
+
+import asyncio
+import json
+import sys
+
+from server import RETENTION_POLICIES, apply_retention, client, retention_report
+
+async def run(apply: bool) -> dict:
+    try:
+        return await (apply_retention() if apply else retention_report())
+    finally:
+        client.close()
+
+def main():
+    apply = "--apply" in sys.argv[1:]
+    result = asyncio.run(run(apply))
+
+    print(json.dumps(result, indent=2))
+    for name, policy in RETENTION_POLICIES.items():
+        if name not in result:
+            print(f"⏭️  {name}: retention disabled", file=sys.stderr)
+        elif apply:
+            print(f"🗑️  {name}: archived {result[name]['archived']}, deleted {result[name]['deleted']}", file=sys.stderr)
+        else:
+            mib = result[name]["bytes"] / 2**20
+            print(f"📋 {name}: {result[name]['documents']} documents ({mib:.1f} MiB) older than {result[name]['cutoff']}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
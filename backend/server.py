@@ -1,8 +1,10 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Header, Cookie, Response, WebSocket, WebSocketDisconnect, Request, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
@@ -10,17 +12,224 @@ from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta
-import requests
+import httpx
 from emergentintegrations.llm.chat import LlmChat, UserMessage
+from chat_storage import ChatBucketStore, SequenceAllocator
+from llm_control import CircuitBreaker, LLMScheduler, LLMUnavailableError
+from post_search import PostSearchIndex
+from typing_indicators import TypingTracker
 import json
 import asyncio
+import time
+import math
+import sys
+import threading
+import traceback
+import contextvars
+import copy
+import hashlib
+import queue
+import logging.handlers
+import random
+import re
+import base64
+import gzip
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import msgpack
+except ImportError:  # MessagePack WebSocket frames are optional
+    msgpack = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Request tracing - sampled root span per request with child spans for Mongo, HTTP and LLM calls
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+# Only honour the sampled flag of an incoming traceparent when it comes from a trusted proxy
+TRACE_TRUST_PARENT = os.environ.get('TRACE_TRUST_PARENT', 'false').lower() == 'true'
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: dict, name: str, parent_id: Optional[str], kind: int, attributes: dict):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind  # OTLP SpanKind: 2 = server, 3 = client
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def end(self, error: Optional[BaseException] = None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = repr(error)
+        self.trace["spans"].append(self)
+
+current_span_var: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+@contextmanager
+def trace_span(name: str, **attributes):
+    """Open a child span of the current span - a no-op when the request is not sampled"""
+    parent = current_span_var.get()
+    if parent is None:
+        yield None
+        return
+    span = Span(parent.trace, name, parent.span_id, 3, attributes)
+    token = current_span_var.set(span)
+    error = None
+    try:
+        yield span
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span_var.reset(token)
+        span.end(error)
+
+class OTLPFileExporter:
+    """Append each finished trace as one OTLP/JSON line (readable by the collector's otlpjsonfile receiver).
+
+    The file is rotated once it reaches `max_bytes`: it moves to `<path>.1`, older files
+    shift up, and only `backups` of them are kept.
+    """
+
+    def __init__(self, path: str, service_name: str = "circle-of-care-api", max_bytes: int = 100 * 1024 * 1024, backups: int = 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.resource = {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]}
+
+    @staticmethod
+    def _span(span: Span) -> dict:
+        encoded = {
+            "traceId": span.trace["trace_id"],
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 0}
+        }
+        if span.parent_id:
+            encoded["parentSpanId"] = span.parent_id
+        return encoded
+
+    def export(self, trace: dict):
+        line = json.dumps({"resourceSpans": [{
+            "resource": self.resource,
+            "scopeSpans": [{"scope": {"name": "circle-of-care"}, "spans": [self._span(span) for span in trace["spans"]]}]
+        }]})
+        try:
+            if os.path.getsize(self.path) + len(line) >= self.max_bytes:
+                self._rotate()
+        except FileNotFoundError:
+            pass
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+class Tracer:
+    """Samples requests and hands finished traces to the exporter on a background thread"""
+
+    def __init__(self, sample_rate: float, exporter=None, trust_parent: bool = False, max_queued: int = 1000):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.trust_parent = trust_parent
+        self.max_queued = max_queued
+        self.queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.dropped = 0
+        if exporter is not None and sample_rate > 0:
+            threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True).start()
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes) -> Optional[Span]:
+        """Start a root span, continuing an incoming W3C traceparent when there is one.
+
+        The upstream sampled flag decides only when `trust_parent` is set; otherwise any
+        client could force every request to be traced, so the local rate still applies.
+        """
+        trace_id, parent_id, sampled = None, None, random.random() < self.sample_rate
+        if traceparent:
+            parts = traceparent.split("-")
+            if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+                trace_id, parent_id = parts[1], parts[2]
+                if self.trust_parent:
+                    sampled = parts[3] == "01" and self.sample_rate > 0
+        if not sampled or self.exporter is None:
+            return None
+        trace = {"trace_id": trace_id or uuid.uuid4().hex, "spans": []}
+        return Span(trace, name, parent_id, 2, attributes)
+
+    def finish(self, root: Span, error: Optional[BaseException] = None):
+        root.end(error)
+        if self.queue.qsize() >= self.max_queued:
+            self.dropped += 1
+            return
+        self.queue.put(root.trace)
+
+    def _export_loop(self):
+        while True:
+            trace = self.queue.get()
+            try:
+                self.exporter.export(trace)
+            except Exception:
+                self.dropped += 1
+
+def _build_span_exporter():
+    exporter = os.environ.get('TRACE_EXPORTER', 'file')
+    if exporter == 'file':
+        return OTLPFileExporter(
+            os.environ.get('TRACE_FILE', str(ROOT_DIR / 'traces.ndjson')),
+            max_bytes=int(os.environ.get('TRACE_FILE_MAX_BYTES', str(100 * 1024 * 1024))),
+            backups=int(os.environ.get('TRACE_FILE_BACKUPS', '3'))
+        )
+    return None
+
+tracer = Tracer(TRACE_SAMPLE_RATE, _build_span_exporter(), TRACE_TRUST_PARENT)
+
+class MongoSpanListener(monitoring.CommandListener):
+    """Child span per MongoDB command. Motor copies the caller's context onto its executor,
+    so the current span is visible here."""
+
+    def __init__(self):
+        self.pending: Dict[tuple, Span] = {}
+
+    def started(self, event):
+        parent = current_span_var.get()
+        if parent is None:
+            return
+        collection = event.command.get(event.command_name)
+        self.pending[(event.connection_id, event.request_id)] = Span(
+            parent.trace, f"mongo.{event.command_name}", parent.span_id, 3,
+            {"db.system": "mongodb", "db.name": event.database_name, "db.collection": collection if isinstance(collection, str) else ""}
+        )
+
+    def succeeded(self, event):
+        span = self.pending.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.end()
+
+    def failed(self, event):
+        span = self.pending.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.end(Exception(str(event.failure)))
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoSpanListener()] if TRACE_SAMPLE_RATE > 0 else [])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
@@ -29,64 +238,237 @@ app = FastAPI()
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# WebSocket frame encodings - JSON text by default, MessagePack binary on request
+def negotiate_encoding(requested: Optional[str]) -> str:
+    """Pick the frame encoding for a connection, falling back to JSON when MessagePack is unavailable"""
+    if requested == "msgpack" and msgpack is not None:
+        return "msgpack"
+    return "json"
+
+def encode_frame(message: dict, encoding: str = "json"):
+    """Encode a payload once - str for JSON text frames, bytes for MessagePack binary frames"""
+    if encoding == "msgpack":
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message, separators=(",", ":"))
+
+def decode_frame(message: dict) -> dict:
+    """Decode a raw ASGI websocket.receive event into a payload dict"""
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("Binary frames require MessagePack support")
+        return msgpack.unpackb(message["bytes"], raw=False)
+    return json.loads(message.get("text") or "{}")
+
+async def send_frame(websocket: WebSocket, frame):
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
+
 # WebSocket connection manager for live chat
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[Dict] = []
+        self.rooms: Dict[str, List[Dict]] = {}  # community_id -> connections
+        self.online: Dict[str, Dict[str, int]] = {}  # community_id -> user_id -> open connections
+        self.presence_changes: Dict[str, Dict[str, List[str]]] = {}  # community_id -> joined/left names since the last snapshot
 
-    async def connect(self, websocket: WebSocket, user_id: str, user_name: str, community_id: str = "general"):
+    async def connect(self, websocket: WebSocket, user_id: str, user_name: str, community_id: str = "general", encoding: str = "json"):
         await websocket.accept()
         connection_info = {
             "websocket": websocket,
             "user_id": user_id,
             "user_name": user_name,
             "community_id": community_id,
+            "encoding": encoding,
             "connected_at": datetime.now(timezone.utc)
         }
         self.active_connections.append(connection_info)
+        self.rooms.setdefault(community_id, []).append(connection_info)
         
-        # Notify others that user joined
-        await self.broadcast_to_community(community_id, {
-            "type": "user_joined",
-            "user_name": user_name,
-            "message": f"{user_name} joined the chat",
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        }, exclude_user=user_id)
+        # Joins are announced in the next presence snapshot rather than one frame each
+        users = self.online.setdefault(community_id, {})
+        users[user_id] = users.get(user_id, 0) + 1
+        if users[user_id] == 1:
+            self._presence_change(community_id, "joined", user_name)
+
+    def _presence_change(self, community_id: str, kind: str, user_name: str):
+        self.presence_changes.setdefault(community_id, {"joined": [], "left": []})[kind].append(user_name)
+
+    def _remove(self, connection: Dict):
+        if connection not in self.active_connections:
+            return
+        self.active_connections.remove(connection)
+        community_id = connection["community_id"]
+        room = self.rooms.get(community_id, [])
+        room.remove(connection)
+        if not room:
+            self.rooms.pop(community_id, None)
+        
+        users = self.online.get(community_id, {})
+        users[connection["user_id"]] -= 1
+        if not users[connection["user_id"]]:
+            del users[connection["user_id"]]
+            self._presence_change(community_id, "left", connection["user_name"])
+        if not users:
+            self.online.pop(community_id, None)
+
+    def online_count(self, community_id: str) -> int:
+        return len(self.online.get(community_id, ()))
 
     def disconnect(self, websocket: WebSocket):
         connection = next((conn for conn in self.active_connections if conn["websocket"] == websocket), None)
         if connection:
-            self.active_connections.remove(connection)
+            self._remove(connection)
             return connection
         return None
 
     async def broadcast_to_community(self, community_id: str, message: dict, exclude_user: str = None):
         """Broadcast message to all users in a specific community"""
         disconnected_connections = []
-        for connection in self.active_connections:
-            if connection["community_id"] == community_id and connection["user_id"] != exclude_user:
+        frames = {}  # encoding -> payload, so each encoding is serialized once per broadcast
+        for connection in list(self.rooms.get(community_id, ())):
+            if connection["user_id"] != exclude_user:
+                encoding = connection.get("encoding", "json")
+                if encoding not in frames:
+                    frames[encoding] = encode_frame(message, encoding)
                 try:
-                    await connection["websocket"].send_text(json.dumps(message))
+                    await send_frame(connection["websocket"], frames[encoding])
                 except:
                     disconnected_connections.append(connection)
         
         # Clean up disconnected connections
         for conn in disconnected_connections:
-            self.active_connections.remove(conn)
+            self._remove(conn)
 
     async def send_personal_message(self, user_id: str, message: dict):
         """Send private message to specific user"""
         connection = next((conn for conn in self.active_connections if conn["user_id"] == user_id), None)
         if connection:
             try:
-                await connection["websocket"].send_text(json.dumps(message))
+                await send_frame(connection["websocket"], encode_frame(message, connection.get("encoding", "json")))
                 return True
             except:
-                self.active_connections.remove(connection)
+                self._remove(connection)
         return False
 
 manager = ConnectionManager()
 
+# Presence - online counts per community, shared between workers through heartbeat documents
+WORKER_ID = os.environ.get('WORKER_ID') or uuid.uuid4().hex[:12]
+PRESENCE_SNAPSHOT_SECONDS = float(os.environ.get('PRESENCE_SNAPSHOT_SECONDS', '2'))
+PRESENCE_HEARTBEAT_SECONDS = float(os.environ.get('PRESENCE_HEARTBEAT_SECONDS', '10'))
+
+class PresenceTracker:
+    """Online counts per community across workers, with coalesced presence frames.
+
+    The connection manager keeps this worker's online users per room and notes who came
+    and went. Every `snapshot_seconds` each room with changes gets one `presence` frame
+    carrying the online count and those names, so a join storm costs one frame per room
+    per interval instead of one per connection. Every `heartbeat_seconds` the worker
+    upserts one document per room it serves into db.presence (a TTL index removes them
+    if the worker dies) and reads back the other workers' counts, so `online()` is a
+    dictionary lookup.
+    """
+
+    def __init__(self, connections: ConnectionManager, snapshot_seconds: float = 2.0, heartbeat_seconds: float = 10.0, max_names: int = 20):
+        self.connections = connections
+        self.snapshot_seconds = snapshot_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_names = max_names
+        self.worker_id = WORKER_ID
+        self.remote: Dict[str, int] = {}  # community_id -> users online on other workers
+        self.served: set = set()  # rooms this worker has a heartbeat document for
+        self.last_heartbeat = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    def online(self, community_id: str) -> int:
+        return self.connections.online_count(community_id) + self.remote.get(community_id, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {community_id: self.online(community_id) for community_id in set(self.connections.online) | set(self.remote)}
+
+    async def broadcast_changes(self):
+        changes, self.connections.presence_changes = self.connections.presence_changes, {}
+        for community_id, change in changes.items():
+            await self.connections.broadcast_to_community(community_id, {
+                "type": "presence",
+                "online": self.online(community_id),
+                "joined": change["joined"][:self.max_names],
+                "left": change["left"][:self.max_names],
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            })
+
+    async def heartbeat(self):
+        now = datetime.now(timezone.utc)
+        # TTL indexes need BSON dates, so expires_at is not stored as an ISO string here
+        expires_at = now + timedelta(seconds=self.heartbeat_seconds * 3)
+        rooms = {community_id: len(users) for community_id, users in self.connections.online.items()}
+        operations = [
+            UpdateOne(
+                {"_id": f"{self.worker_id}:{community_id}"},
+                {"$set": {"worker_id": self.worker_id, "community_id": community_id, "count": count, "expires_at": expires_at}},
+                upsert=True
+            )
+            for community_id, count in rooms.items()
+        ]
+        operations += [DeleteOne({"_id": f"{self.worker_id}:{community_id}"}) for community_id in self.served - set(rooms)]
+        if operations:
+            await db.presence.bulk_write(operations, ordered=False)
+        self.served = set(rooms)
+        
+        remote: Dict[str, int] = {}
+        async for doc in db.presence.find({"worker_id": {"$ne": self.worker_id}, "expires_at": {"$gt": now}}, {"community_id": 1, "count": 1}):
+            remote[doc["community_id"]] = remote.get(doc["community_id"], 0) + doc["count"]
+        
+        # Rooms whose remote count moved get a snapshot too
+        for community_id in set(remote) | set(self.remote):
+            if remote.get(community_id, 0) != self.remote.get(community_id, 0) and community_id in self.connections.rooms:
+                self.connections.presence_changes.setdefault(community_id, {"joined": [], "left": []})
+        self.remote = remote
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.snapshot_seconds)
+            try:
+                if time.monotonic() - self.last_heartbeat >= self.heartbeat_seconds:
+                    self.last_heartbeat = time.monotonic()
+                    await self.heartbeat()
+                await self.broadcast_changes()
+            except Exception as e:
+                logging.error("Error updating presence: %s", e)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await db.presence.delete_many({"worker_id": self.worker_id})
+
+presence = PresenceTracker(manager, PRESENCE_SNAPSHOT_SECONDS, PRESENCE_HEARTBEAT_SECONDS)
+
+# Typing indicators - debounced per user, one aggregate frame per room per flush
+TYPING_FLUSH_SECONDS = float(os.environ.get('TYPING_FLUSH_SECONDS', '0.5'))
+
+typing_tracker = TypingTracker(
+    ttl=float(os.environ.get('TYPING_TTL_SECONDS', '5')),
+    debounce=float(os.environ.get('TYPING_DEBOUNCE_SECONDS', '1'))
+)
+
+async def broadcast_typing():
+    """Every TYPING_FLUSH_SECONDS send each room whose typists changed a `typing` frame"""
+    while True:
+        await asyncio.sleep(TYPING_FLUSH_SECONDS)
+        try:
+            for community_id, (names, count) in typing_tracker.flush(time.monotonic()).items():
+                await manager.broadcast_to_community(community_id, {"type": "typing", "users": names, "count": count})
+        except Exception as e:
+            logging.error("Error broadcasting typing indicators: %s", e)
+
 # Pydantic Models
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -119,10 +501,16 @@ class Community(BaseModel):
     category: str  # ptsd, chronic-pain, cancer, veterans, general-wellness, etc.
     is_private: bool = True
     member_count: int = 0
+    post_count: int = 0
+    messages_today: int = 0
+    last_activity_at: Optional[datetime] = None
+    activity_score: float = 0.0  # time-decayed recent activity ("active now")
+    trending_score: float = 0.0  # recent activity relative to the community's usual pace
     created_by: str
     moderators: List[str] = []
     rules: List[str] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Post(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -136,6 +524,22 @@ class Post(BaseModel):
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     is_flagged: bool = False
     flag_count: int = 0
+    reply_count: int = 0
+    reactions: Dict[str, int] = {}  # reaction -> count
+
+class Reply(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    post_id: str
+    community_id: str
+    parent_id: Optional[str] = None
+    author_id: str
+    content: str
+    is_anonymous: bool = False
+    path: str  # materialized path - sorting by it gives the thread in display order
+    depth: int = 0
+    reply_count: int = 0
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    is_flagged: bool = False
 
 class ChatMessage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -154,6 +558,7 @@ class LiveChatMessage(BaseModel):
     is_anonymous: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     is_moderated: bool = False
+    seq: int = 0  # per-community, monotonically increasing
 
 class PanicButtonRequest(BaseModel):
     user_id: str
@@ -187,6 +592,11 @@ class PostCreate(BaseModel):
     is_anonymous: bool = False
     support_type: str = "general"
 
+class ReplyCreate(BaseModel):
+    content: str
+    parent_id: Optional[str] = None
+    is_anonymous: bool = False
+
 class ChatRequest(BaseModel):
     message: str
     is_panic: bool = False
@@ -196,6 +606,14 @@ class LiveChatMessageCreate(BaseModel):
     message: str
     is_anonymous: bool = False
 
+class UserCardsRequest(BaseModel):
+    ids: List[str]
+
+class ReactionRequest(BaseModel):
+    target_type: str  # post, chat
+    target_id: str
+    reaction: str = "hug"
+
 # Helper Functions
 def prepare_for_mongo(data: dict) -> dict:
     """Prepare data for MongoDB storage by converting dates to ISO strings"""
@@ -214,7 +632,1097 @@ def parse_from_mongo(item: dict) -> dict:
                 pass
     return item
 
-async def moderate_content(content: str) -> Dict[str, Any]:
+def hide_anonymous_author(item: dict) -> dict:
+    """Swap the author of an anonymous post or reply for an alias that is unique to that item"""
+    if item.get("is_anonymous"):
+        item["author_id"] = f"anonymous_{item['id'][:8]}"
+    return item
+
+def serialize_live_chat(msg: dict) -> dict:
+    """Convert a stored live chat document into the public message shape"""
+    return {
+        "id": msg["id"],
+        "user_name": msg["user_name"] if not msg.get("is_anonymous", True) else f"Anonymous{msg['user_id'][-4:]}",
+        "message": msg["message"],
+        "timestamp": msg["created_at"],
+        "seq": msg.get("seq", 0),
+        "type": "message"
+    }
+
+# Blocks above 1 are only safe when a single worker serves live chat - see SequenceAllocator
+chat_sequences = SequenceAllocator(
+    db.counters,
+    block_size=int(os.environ.get('CHAT_SEQ_BLOCK_SIZE', '1'))
+)
+
+# Live chat storage - one document per message, or per-community bucket documents
+CHAT_STORAGE = os.environ.get('CHAT_STORAGE', 'messages')  # messages, dual (while migrating) or buckets
+CHAT_BUCKET_SIZE = int(os.environ.get('CHAT_BUCKET_SIZE', '200'))
+
+chat_bucket_store = ChatBucketStore(db.live_chat_buckets, size=CHAT_BUCKET_SIZE)
+
+async def load_latest_chat(community_id: str, limit: int) -> List[dict]:
+    if CHAT_STORAGE == 'buckets':
+        return await chat_bucket_store.latest(community_id, limit)
+    messages = await db.live_chat.find(
+        {"community_id": community_id}
+    ).sort("created_at", -1).limit(limit).to_list(length=None)
+    messages.reverse()
+    return messages
+
+async def load_chat_since(community_id: str, last_seq: int, limit: int) -> List[dict]:
+    if CHAT_STORAGE == 'buckets':
+        return await chat_bucket_store.since(community_id, last_seq, limit)
+    return await db.live_chat.find(
+        {"community_id": community_id, "seq": {"$gt": last_seq}}
+    ).sort("seq", 1).limit(limit).to_list(length=None)
+
+async def migrate_live_chat_to_buckets(batch_size: int = 1000) -> int:
+    """Copy per-message live_chat documents into buckets and return how many were copied.
+
+    Run while serving with CHAT_STORAGE=dual (new messages are written to both layouts),
+    then switch to CHAT_STORAGE=buckets. Progress is checkpointed by _id so an interrupted
+    run resumes where it stopped, and messages a bucket already holds are skipped.
+    """
+    state = await db.migrations.find_one({"_id": "live_chat_buckets"}) or {}
+    copied = 0
+    last_id = state.get("last_id")
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await db.live_chat.find(query).sort("_id", 1).limit(batch_size).to_list(length=None)
+        if not batch:
+            break
+        await chat_bucket_store.add_many(batch)
+        last_id = batch[-1]["_id"]
+        copied += len(batch)
+        await db.migrations.update_one(
+            {"_id": "live_chat_buckets"},
+            {"$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc).isoformat()}, "$inc": {"copied": len(batch)}},
+            upsert=True
+        )
+    return copied
+
+class ChatHistoryBuffer:
+    """In-memory ring buffer of recent live chat messages per community.
+
+    Rooms are warmed lazily from MongoDB on first access and appended to on every
+    send, so polling and WebSocket joins never touch the database. Memory is capped
+    by the number of rooms kept (least recently used rooms are dropped first) and
+    rooms that nobody has read for a while are evicted. Only cold rooms and requests
+    deeper than the buffer size fall through to MongoDB.
+    """
+
+    def __init__(self, size: int = 50, max_rooms: int = 500, idle_seconds: int = 900):
+        self.size = size
+        self.max_rooms = max_rooms
+        self.idle_seconds = idle_seconds
+        self.rooms: "OrderedDict[str, deque]" = OrderedDict()
+        self.last_access: Dict[str, float] = {}
+        self.warm_locks: Dict[str, asyncio.Lock] = {}
+        self.warming: Dict[str, List[dict]] = {}  # community_id -> messages stored while the room loads
+
+    def _touch(self, community_id: str):
+        self.rooms.move_to_end(community_id)
+        self.last_access[community_id] = time.monotonic()
+
+    def _evict(self):
+        """Drop idle rooms and enforce the room cap (rooms are kept in LRU order)"""
+        cutoff = time.monotonic() - self.idle_seconds
+        while self.rooms:
+            oldest = next(iter(self.rooms))
+            if len(self.rooms) <= self.max_rooms and self.last_access.get(oldest, 0) >= cutoff:
+                break
+            self.rooms.pop(oldest)
+            self.last_access.pop(oldest, None)
+
+    async def _warm(self, community_id: str) -> deque:
+        lock = self.warm_locks.setdefault(community_id, asyncio.Lock())
+        async with lock:
+            # Another request may have warmed the room while we waited
+            if community_id in self.rooms:
+                return self.rooms[community_id]
+            # Messages stored while the query runs may be missing from its result - collect them
+            self.warming[community_id] = []
+            try:
+                messages = await load_latest_chat(community_id, self.size)
+            finally:
+                appended = self.warming.pop(community_id)
+            entries = [serialize_live_chat(msg) for msg in messages]
+            loaded = {entry["id"] for entry in entries}
+            missed = [entry for entry in appended if entry["id"] not in loaded]
+            if missed:
+                entries = sorted(entries + missed, key=lambda entry: entry["seq"])
+            room = deque(entries, maxlen=self.size)
+            self.rooms[community_id] = room
+            self._touch(community_id)
+            self._evict()
+            self.warm_locks.pop(community_id, None)
+            return room
+
+    async def recent(self, community_id: str, limit: int = 50) -> List[dict]:
+        """Return the latest `limit` messages in chronological order"""
+        if limit <= 0:
+            return []
+        if limit > self.size:
+            # Deep history request - bypass the buffer
+            messages = await load_latest_chat(community_id, limit)
+            return [serialize_live_chat(msg) for msg in messages]
+
+        room = self.rooms.get(community_id)
+        if room is None:
+            room = await self._warm(community_id)
+        else:
+            self._touch(community_id)
+            self._evict()
+        return list(room)[-limit:]
+
+    async def since(self, community_id: str, last_seq: int, limit: int = 500) -> List[dict]:
+        """Return messages with a sequence number above `last_seq`, from memory when the buffer covers the gap"""
+        room = self.rooms.get(community_id)
+        if room is None:
+            room = await self._warm(community_id)
+        else:
+            self._touch(community_id)
+        
+        # The buffer covers the gap if it still holds the client's last message (or the whole history)
+        if len(room) < self.size or (room and room[0]["seq"] <= last_seq):
+            return [entry for entry in room if entry["seq"] > last_seq][:limit]
+        
+        messages = await load_chat_since(community_id, last_seq, limit)
+        return [serialize_live_chat(msg) for msg in messages]
+
+    def append(self, community_id: str, entry: dict):
+        """Record a freshly stored message; cold rooms are left for the next warm-up"""
+        room = self.rooms.get(community_id)
+        if room is not None:
+            room.append(entry)
+        elif community_id in self.warming:
+            self.warming[community_id].append(entry)
+
+class ChatWaiters:
+    """Per-community wakeups for long-polling clients.
+
+    Each community has one pending asyncio.Event that is set and replaced whenever a
+    message is stored. Waiters grab the event *before* checking for new messages, so a
+    message that lands in between still wakes them.
+    """
+
+    def __init__(self):
+        self.events: Dict[str, asyncio.Event] = {}
+        self.waiting: Dict[str, int] = {}
+
+    def current(self, community_id: str) -> asyncio.Event:
+        return self.events.setdefault(community_id, asyncio.Event())
+
+    async def wait(self, community_id: str, event: asyncio.Event, timeout: float) -> bool:
+        """Wait until `event` fires or `timeout` elapses; returns True when woken"""
+        self.waiting[community_id] = self.waiting.get(community_id, 0) + 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting[community_id] -= 1
+            if not self.waiting[community_id]:
+                del self.waiting[community_id]
+                if self.events.get(community_id) is event:
+                    del self.events[community_id]
+
+    def notify(self, community_id: str):
+        event = self.events.pop(community_id, None)
+        if event:
+            event.set()
+
+chat_waiters = ChatWaiters()
+
+class ChatWriteLocks:
+    """Serializes chat writes per community so messages are stored and buffered in seq order.
+
+    Without it two sends can allocate seq 1 and 2 and finish their inserts in reverse,
+    and a poller that already saw seq 2 would never ask for seq 1.
+    """
+
+    def __init__(self):
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.holders: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, community_id: str):
+        lock = self.locks.setdefault(community_id, asyncio.Lock())
+        self.holders[community_id] = self.holders.get(community_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.holders[community_id] -= 1
+            if not self.holders[community_id]:
+                del self.holders[community_id]
+                del self.locks[community_id]
+
+chat_write_locks = ChatWriteLocks()
+
+chat_buffer = ChatHistoryBuffer(
+    size=int(os.environ.get('CHAT_BUFFER_SIZE', '50')),
+    max_rooms=int(os.environ.get('CHAT_BUFFER_MAX_ROOMS', '500')),
+    idle_seconds=int(os.environ.get('CHAT_BUFFER_IDLE_SECONDS', '900'))
+)
+
+async def store_live_chat_message(community_id: str, message_content: str, user_id: str, user_name: str, is_anonymous: bool) -> dict:
+    """Persist a live chat message, append it to the history buffer and return its public shape"""
+    async with chat_write_locks.hold(community_id):
+        chat_message = LiveChatMessage(
+            community_id=community_id,
+            user_id=user_id,
+            user_name=user_name,
+            message=message_content,
+            is_anonymous=is_anonymous,
+            seq=await chat_sequences.next(community_id)
+        )
+        chat_dict = prepare_for_mongo(chat_message.dict())
+        if CHAT_STORAGE != 'buckets':
+            await db.live_chat.insert_one(chat_dict)
+        if CHAT_STORAGE != 'messages':
+            await chat_bucket_store.append(chat_dict)
+        entry = serialize_live_chat(chat_dict)
+        chat_buffer.append(community_id, entry)
+    chat_waiters.notify(community_id)
+    community_counters.record_message(community_id, chat_dict["created_at"])
+    activity_ranking.record(community_id, "message")
+    return entry
+
+# Community counters - deltas are buffered in memory and flushed as batched $inc updates
+COUNTER_FLUSH_SECONDS = float(os.environ.get('COUNTER_FLUSH_SECONDS', '2'))
+COUNTER_RECONCILE_SECONDS = float(os.environ.get('COUNTER_RECONCILE_SECONDS', '3600'))
+
+class CommunityCounters:
+    """Denormalized per-community stats kept on the community document.
+
+    Posts, chat messages (per UTC day, in `messages_by_day`) and the last activity time
+    are counted in memory and written every `flush_seconds` as one $inc/$max update per
+    community in a single bulk write. New members are upserted into community_members in
+    the same flush, and only upserts that actually inserted a document bump member_count.
+    A periodic reconciliation recomputes every counter from the source collections to
+    repair drift (a crash before a flush, deleted posts, retention).
+    """
+
+    def __init__(self, flush_seconds: float = 2.0, reconcile_seconds: float = 3600.0, known_members: int = 10000):
+        self.flush_seconds = flush_seconds
+        self.reconcile_seconds = reconcile_seconds
+        self.pending: Dict[str, Dict[str, Any]] = {}  # community_id -> {"inc": {...}, "last_activity_at": ...}
+        self.new_members: Dict[tuple, str] = {}  # (community_id, user_id) -> joined_at
+        self.known_members: "OrderedDict[tuple, bool]" = OrderedDict()
+        self.known_members_max = known_members
+        self.last_reconcile = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _merge(pending: Dict[str, Dict[str, Any]], community_id: str, inc: Dict[str, int], at: Optional[str]):
+        entry = pending.setdefault(community_id, {"inc": {}, "last_activity_at": None})
+        for field, amount in inc.items():
+            entry["inc"][field] = entry["inc"].get(field, 0) + amount
+        if at and (entry["last_activity_at"] is None or at > entry["last_activity_at"]):
+            entry["last_activity_at"] = at
+
+    def record(self, community_id: str, field: Optional[str] = None, at: Optional[str] = None):
+        """Count one event for `field` (if given) and mark the community active"""
+        at = at or datetime.now(timezone.utc).isoformat()
+        self._merge(self.pending, community_id, {field: 1} if field else {}, at)
+
+    def record_post(self, community_id: str, at: str):
+        self._merge(self.pending, community_id, {"post_count": 1, "post_seq": 1}, at)
+
+    def record_message(self, community_id: str, at: str):
+        self._merge(self.pending, community_id, {f"messages_by_day.{at[:10]}": 1, "message_seq": 1}, at)
+
+    def record_member(self, community_id: str, user_id: str):
+        """Queue a membership upsert unless this worker has already seen the pair recently"""
+        key = (community_id, user_id)
+        if key in self.known_members:
+            self.known_members.move_to_end(key)
+            return
+        self.known_members[key] = True
+        if len(self.known_members) > self.known_members_max:
+            self.known_members.popitem(last=False)
+        self.new_members.setdefault(key, datetime.now(timezone.utc).isoformat())
+
+    def live_stats(self, doc: dict) -> dict:
+        """Counters for a stored community document, including this worker's unflushed deltas"""
+        today = datetime.now(timezone.utc).date().isoformat()
+        entry = self.pending.get(doc.get("id"), {"inc": {}, "last_activity_at": None})
+        last_activity = max(filter(None, [doc.get("last_activity_at"), entry["last_activity_at"]]), default=None)
+        return {
+            **doc,
+            "post_count": doc.get("post_count", 0) + entry["inc"].get("post_count", 0),
+            "messages_today": doc.get("messages_by_day", {}).get(today, 0) + entry["inc"].get(f"messages_by_day.{today}", 0),
+            "last_activity_at": last_activity
+        }
+
+    def sequences(self, doc: dict) -> Dict[str, int]:
+        """Post and message sequence numbers (never reset by reconciliation), including unflushed deltas"""
+        inc = self.pending.get(doc.get("id"), {"inc": {}})["inc"]
+        return {
+            "post_seq": doc.get("post_seq", 0) + inc.get("post_seq", 0),
+            "message_seq": doc.get("message_seq", 0) + inc.get("message_seq", 0)
+        }
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        new_members, self.new_members = self.new_members, {}
+        try:
+            if new_members:
+                keys = list(new_members)
+                try:
+                    result = await db.community_members.bulk_write([
+                        UpdateOne(
+                            {"_id": f"{community_id}:{user_id}"},
+                            {"$setOnInsert": {"community_id": community_id, "user_id": user_id, "joined_at": new_members[(community_id, user_id)]}},
+                            upsert=True
+                        )
+                        for community_id, user_id in keys
+                    ], ordered=False)
+                    upserted = list(result.upserted_ids)
+                    new_members = {}
+                except BulkWriteError as e:
+                    # Count the members that were inserted now - a retried upsert would not report them again
+                    upserted = [item["index"] for item in e.details.get("upserted", [])]
+                    failed = {error["index"] for error in e.details.get("writeErrors", [])}
+                    new_members = {keys[index]: new_members[keys[index]] for index in failed}
+                    logging.error("Error flushing community members: %s", e)
+                for index in upserted:
+                    self._merge(pending, keys[index][0], {"member_count": 1}, None)
+            
+            operations, targets = [], []
+            for community_id, entry in pending.items():
+                update: Dict[str, Any] = {}
+                if entry["inc"]:
+                    update["$inc"] = entry["inc"]
+                if entry["last_activity_at"]:
+                    update["$max"] = {"last_activity_at": entry["last_activity_at"]}
+                if update:
+                    operations.append(UpdateOne({"id": community_id}, update))
+                    targets.append(community_id)
+            if operations:
+                try:
+                    await db.communities.bulk_write(operations, ordered=False)
+                except BulkWriteError as e:
+                    # The other updates were applied - only the failed ones are kept for a retry
+                    failed = {error["index"] for error in e.details.get("writeErrors", [])}
+                    pending = {targets[index]: pending[targets[index]] for index in failed}
+                    raise
+        except Exception as e:
+            # Keep the deltas for the next flush
+            for community_id, entry in pending.items():
+                self._merge(self.pending, community_id, entry["inc"], entry["last_activity_at"])
+            logging.error("Error flushing community counters: %s", e)
+        for key, joined_at in new_members.items():
+            self.new_members.setdefault(key, joined_at)
+
+    async def reconcile(self):
+        """Recompute every community's counters from posts, live chat and community_members"""
+        await self.flush()
+        today = datetime.now(timezone.utc).date().isoformat()
+        async for community in db.communities.find({}, {"id": 1, "last_activity_at": 1}):
+            community_id = community["id"]
+            post_count, member_count, (messages_today, last_message_at), last_post = await asyncio.gather(
+                db.posts.count_documents({"community_id": community_id}),
+                db.community_members.count_documents({"community_id": community_id}),
+                chat_activity_since(community_id, today),
+                db.posts.find_one({"community_id": community_id}, {"created_at": 1}, sort=[("created_at", -1)])
+            )
+            last_activity = max(filter(None, [
+                community.get("last_activity_at"),
+                last_message_at,
+                last_post["created_at"] if last_post else None
+            ]), default=None)
+            counters = {"post_count": post_count, "member_count": member_count, "messages_by_day": {today: messages_today}}
+            if last_activity:
+                counters["last_activity_at"] = last_activity
+            await db.communities.update_one({"id": community_id}, {"$set": counters})
+        self.last_reconcile = time.monotonic()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+            if time.monotonic() - self.last_reconcile >= self.reconcile_seconds:
+                try:
+                    await self.reconcile()
+                except Exception as e:
+                    self.last_reconcile = time.monotonic()
+                    logging.error("Error reconciling community counters: %s", e)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+community_counters = CommunityCounters(COUNTER_FLUSH_SECONDS, COUNTER_RECONCILE_SECONDS)
+
+async def chat_activity_since(community_id: str, since: str) -> tuple:
+    """Number of chat messages created at or after `since` and the newest message time"""
+    if CHAT_STORAGE == 'buckets':
+        latest = await chat_bucket_store.latest(community_id, 1)
+        return await chat_bucket_store.count_since(community_id, since), latest[0]["created_at"] if latest else None
+    count = await db.live_chat.count_documents({"community_id": community_id, "created_at": {"$gte": since}})
+    latest = await db.live_chat.find_one({"community_id": community_id}, {"created_at": 1}, sort=[("created_at", -1)])
+    return count, latest["created_at"] if latest else None
+
+# Activity ranking - exponentially decayed activity per community, merged across workers
+ACTIVITY_FAST_HALF_LIFE_SECONDS = float(os.environ.get('ACTIVITY_FAST_HALF_LIFE_SECONDS', '300'))
+ACTIVITY_SLOW_HALF_LIFE_SECONDS = float(os.environ.get('ACTIVITY_SLOW_HALF_LIFE_SECONDS', '21600'))
+ACTIVITY_PERSIST_SECONDS = float(os.environ.get('ACTIVITY_PERSIST_SECONDS', '15'))
+
+class ActivityRanking:
+    """Time-decayed activity scores per community.
+
+    Each community keeps two exponentially decayed sums of weighted events: a fast one
+    (half-life of minutes - "active now") and a slow one (hours - its usual pace). An
+    event decays the stored sums to the current time and adds its weight, so updates are
+    O(1) and nothing is ever scanned. The trending score divides the fast rate by the slow
+    one: about 1 for a community at its usual pace and higher while it is busier than
+    usual. Every `persist_seconds` each worker saves its own sums to db.activity_scores
+    and reads back the other workers', which are decayed to the current time and added
+    in, so sorting the directory is a sort over numbers held in memory.
+    """
+
+    WEIGHTS = {"post": 5.0, "reply": 3.0, "message": 1.0, "connection": 2.0}
+    TRENDING_PRIOR = 1.0 / 3600  # one message an hour, so quiet communities don't trend on a single event
+
+    def __init__(self, fast_half_life: float = 300.0, slow_half_life: float = 21600.0, persist_seconds: float = 15.0):
+        self.fast_decay = math.log(2) / fast_half_life
+        self.slow_decay = math.log(2) / slow_half_life
+        self.slow_half_life = slow_half_life
+        self.persist_seconds = persist_seconds
+        self.local: Dict[str, List[float]] = {}  # community_id -> [fast, slow, at]
+        self.remote: Dict[str, List[float]] = {}  # other workers' sums, merged
+        self.dirty: set = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def _decayed(self, entry: Optional[List[float]], now: float) -> tuple:
+        if entry is None:
+            return 0.0, 0.0
+        elapsed = max(0.0, now - entry[2])
+        return entry[0] * math.exp(-self.fast_decay * elapsed), entry[1] * math.exp(-self.slow_decay * elapsed)
+
+    def record(self, community_id: str, kind: str, now: Optional[float] = None):
+        now = now or time.time()
+        weight = self.WEIGHTS[kind]
+        fast, slow = self._decayed(self.local.get(community_id), now)
+        self.local[community_id] = [fast + weight, slow + weight, now]
+        self.dirty.add(community_id)
+
+    def scores(self, community_id: str, now: Optional[float] = None) -> tuple:
+        """(fast, slow) decayed sums across all workers"""
+        now = now or time.time()
+        local_fast, local_slow = self._decayed(self.local.get(community_id), now)
+        remote_fast, remote_slow = self._decayed(self.remote.get(community_id), now)
+        return local_fast + remote_fast, local_slow + remote_slow
+
+    def view(self, community_id: str) -> Dict[str, float]:
+        fast, slow = self.scores(community_id)
+        trending = (fast * self.fast_decay + self.TRENDING_PRIOR) / (slow * self.slow_decay + self.TRENDING_PRIOR)
+        return {"activity_score": round(fast, 3), "trending_score": round(trending, 3)}
+
+    async def persist(self):
+        now = time.time()
+        dirty, self.dirty = self.dirty, set()
+        if dirty:
+            expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.slow_half_life * 4)
+            await db.activity_scores.bulk_write([
+                UpdateOne(
+                    {"_id": f"{WORKER_ID}:{community_id}"},
+                    {"$set": {
+                        "worker_id": WORKER_ID,
+                        "community_id": community_id,
+                        "fast": self.local[community_id][0],
+                        "slow": self.local[community_id][1],
+                        "at": self.local[community_id][2],
+                        "expires_at": expires_at
+                    }},
+                    upsert=True
+                )
+                for community_id in dirty
+            ], ordered=False)
+        
+        remote: Dict[str, List[float]] = {}
+        async for doc in db.activity_scores.find({"worker_id": {"$ne": WORKER_ID}}, {"community_id": 1, "fast": 1, "slow": 1, "at": 1}):
+            fast, slow = self._decayed([doc["fast"], doc["slow"], doc["at"]], now)
+            merged = remote.setdefault(doc["community_id"], [0.0, 0.0, now])
+            merged[0] += fast
+            merged[1] += slow
+        self.remote = remote
+
+    async def _run(self):
+        # Pick up this worker's saved sums when WORKER_ID is pinned across restarts
+        try:
+            async for doc in db.activity_scores.find({"worker_id": WORKER_ID}):
+                self.local.setdefault(doc["community_id"], [doc["fast"], doc["slow"], doc["at"]])
+        except Exception as e:
+            logging.error("Error loading activity scores: %s", e)
+        while True:
+            try:
+                await self.persist()
+            except Exception as e:
+                logging.error("Error persisting activity scores: %s", e)
+            await asyncio.sleep(self.persist_seconds)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.persist()
+
+activity_ranking = ActivityRanking(ACTIVITY_FAST_HALF_LIFE_SECONDS, ACTIVITY_SLOW_HALF_LIFE_SECONDS, ACTIVITY_PERSIST_SECONDS)
+
+# Read markers - the community sequence numbers a user has seen, written in coalesced batches
+READ_MARKER_FLUSH_SECONDS = float(os.environ.get('READ_MARKER_FLUSH_SECONDS', '5'))
+
+class ReadMarkers:
+    """Per-user, per-community read positions.
+
+    A marker stores the community's post_seq and message_seq at the time the user last
+    read it, so unread counts are a subtraction against the community document. Marking
+    a room read only updates an in-memory entry (repeat marks overwrite each other) and
+    every `flush_seconds` all dirty markers are written in one bulk write with $max, so
+    flushes from several workers can never move a marker backwards.
+    """
+
+    def __init__(self, flush_seconds: float = 5.0):
+        self.flush_seconds = flush_seconds
+        self.pending: Dict[tuple, Dict[str, int]] = {}  # (user_id, community_id) -> sequences
+        self.task: Optional[asyncio.Task] = None
+
+    def mark(self, user_id: str, community_id: str, sequences: Dict[str, int]):
+        entry = self.pending.setdefault((user_id, community_id), {"post_seq": 0, "message_seq": 0})
+        for field in ("post_seq", "message_seq"):
+            entry[field] = max(entry[field], sequences.get(field, 0))
+
+    async def load(self, user_id: str) -> Dict[str, Dict[str, int]]:
+        """community_id -> seen sequences for a user, including markers not yet flushed"""
+        markers = {
+            doc["community_id"]: {"post_seq": doc.get("post_seq", 0), "message_seq": doc.get("message_seq", 0)}
+            async for doc in db.read_markers.find({"user_id": user_id}, {"_id": 0, "community_id": 1, "post_seq": 1, "message_seq": 1})
+        }
+        for (pending_user, community_id), sequences in self.pending.items():
+            if pending_user == user_id:
+                seen = markers.setdefault(community_id, {"post_seq": 0, "message_seq": 0})
+                for field in ("post_seq", "message_seq"):
+                    seen[field] = max(seen[field], sequences[field])
+        return markers
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            await db.read_markers.bulk_write([
+                UpdateOne(
+                    {"_id": f"{user_id}:{community_id}"},
+                    {"$max": sequences, "$set": {"user_id": user_id, "community_id": community_id, "updated_at": now}},
+                    upsert=True
+                )
+                for (user_id, community_id), sequences in pending.items()
+            ], ordered=False)
+        except Exception as e:
+            for (user_id, community_id), sequences in pending.items():
+                self.mark(user_id, community_id, sequences)
+            logging.error("Error flushing read markers: %s", e)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+read_markers = ReadMarkers(READ_MARKER_FLUSH_SECONDS)
+
+# Reactions - one document per user and reaction (unique index), counts flushed as batched $inc
+REACTION_TYPES = ["hug", "heart", "strength"]
+REACTION_TARGETS = ["post", "chat"]
+REACTION_FLUSH_SECONDS = float(os.environ.get('REACTION_FLUSH_SECONDS', '1'))
+
+class ReactionBuffer:
+    """Buffers reactions in memory and writes them in batches.
+
+    A tap does not write: the reaction document is queued (a repeat tap while it is
+    queued is a no-op) and the request returns. Every `flush_seconds` the queue is written
+    with one unordered insert_many; the unique index on (target_type, target_id, user_id,
+    reaction) rejects reactions the user had already given, and only the inserts that
+    succeeded become $inc updates - on the post document for posts, in reaction_counts for
+    chat messages - in one bulk write per collection. Reads add this worker's queued
+    reactions on top of the stored counts.
+    """
+
+    def __init__(self, flush_seconds: float = 1.0):
+        self.flush_seconds = flush_seconds
+        self.pending: Dict[tuple, dict] = {}  # (target_type, target_id, user_id, reaction) -> document
+        self.deltas: Dict[tuple, Dict[str, int]] = {}  # (target_type, target_id) -> reaction -> change not yet in the counts
+        self.task: Optional[asyncio.Task] = None
+
+    def _delta(self, target: tuple, reaction: str, amount: int):
+        counts = self.deltas.setdefault(target, {})
+        counts[reaction] = counts.get(reaction, 0) + amount
+
+    def add(self, target_type: str, target_id: str, user_id: str, reaction: str) -> bool:
+        key = (target_type, target_id, user_id, reaction)
+        if key in self.pending:
+            return False
+        self.pending[key] = {
+            "target_type": target_type,
+            "target_id": target_id,
+            "user_id": user_id,
+            "reaction": reaction,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        self._delta((target_type, target_id), reaction, 1)
+        return True
+
+    async def remove(self, target_type: str, target_id: str, user_id: str, reaction: str) -> bool:
+        key = (target_type, target_id, user_id, reaction)
+        queued = self.pending.pop(key, None) is not None
+        if queued:
+            self._delta((target_type, target_id), reaction, -1)
+        # A queued tap may be a repeat of a reaction that is already stored
+        result = await db.reactions.delete_one({"target_type": target_type, "target_id": target_id, "user_id": user_id, "reaction": reaction})
+        if result.deleted_count:
+            self._delta((target_type, target_id), reaction, -1)
+        return queued or bool(result.deleted_count)
+
+    def counts(self, target_type: str, target_id: str, stored: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        counts = dict(stored or {})
+        for reaction, amount in self.deltas.get((target_type, target_id), {}).items():
+            counts[reaction] = max(0, counts.get(reaction, 0) + amount)
+        return {reaction: count for reaction, count in counts.items() if count}
+
+    def with_pending(self, target_type: str, doc: dict) -> dict:
+        return {**doc, "reactions": self.counts(target_type, doc["id"], doc.get("reactions"))}
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        deltas, self.deltas = self.deltas, {}
+        if pending:
+            # Inserts the unique index rejected were repeats - take them back out of the deltas
+            docs = list(pending.values())
+            try:
+                await db.reactions.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    doc = docs[error["index"]]
+                    target = (doc["target_type"], doc["target_id"])
+                    deltas[target][doc["reaction"]] -= 1
+                    if error.get("code") != 11000:
+                        self.pending[(doc["target_type"], doc["target_id"], doc["user_id"], doc["reaction"])] = doc
+                        self._delta(target, doc["reaction"], 1)
+            except Exception as e:
+                for key, doc in pending.items():
+                    self.pending.setdefault(key, doc)
+                for target, counts in deltas.items():
+                    for reaction, amount in counts.items():
+                        self._delta(target, reaction, amount)
+                logging.error("Error flushing reactions: %s", e)
+                return
+        
+        post_updates, chat_updates = [], []  # (target, update)
+        for target, counts in deltas.items():
+            target_type, target_id = target
+            inc = {f"reactions.{reaction}": amount for reaction, amount in counts.items() if amount}
+            if not inc:
+                continue
+            if target_type == "post":
+                post_updates.append((target, UpdateOne({"id": target_id}, {"$inc": inc})))
+            else:
+                chat_updates.append((target, UpdateOne({"_id": f"{target_type}:{target_id}"}, {"$inc": inc}, upsert=True)))
+        for collection, updates in ((db.posts, post_updates), (db.reaction_counts, chat_updates)):
+            if not updates:
+                continue
+            try:
+                await collection.bulk_write([update for _, update in updates], ordered=False)
+            except Exception as e:
+                # The reaction documents are stored, so a lost delta would never come back -
+                # keep the counts that were not applied for the next flush
+                failed = range(len(updates))
+                if isinstance(e, BulkWriteError):
+                    failed = [error["index"] for error in e.details.get("writeErrors", [])]
+                for index in failed:
+                    target = updates[index][0]
+                    for reaction, amount in deltas[target].items():
+                        self._delta(target, reaction, amount)
+                logging.error("Error flushing reaction counts: %s", e)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+reaction_buffer = ReactionBuffer(REACTION_FLUSH_SECONDS)
+
+async def reaction_target_exists(target_type: str, target_id: str) -> bool:
+    if target_type == "post":
+        return await db.posts.find_one({"id": target_id, "is_flagged": False}, {"_id": 1}) is not None
+    if CHAT_STORAGE == 'buckets':
+        return await db.live_chat_buckets.find_one({"messages.id": target_id}, {"_id": 1}) is not None
+    return await db.live_chat.find_one({"id": target_id}, {"_id": 1}) is not None
+
+async def load_reaction_counts(target_type: str, target_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    """Stored reaction counts by target id, without this worker's queued reactions"""
+    if target_type == "post":
+        docs = await db.posts.find({"id": {"$in": target_ids}}, {"_id": 0, "id": 1, "reactions": 1}).to_list(length=None)
+        return {doc["id"]: doc.get("reactions", {}) for doc in docs}
+    docs = await db.reaction_counts.find({"_id": {"$in": [f"{target_type}:{target_id}" for target_id in target_ids]}}).to_list(length=None)
+    return {doc["_id"].split(":", 1)[1]: doc.get("reactions", {}) for doc in docs}
+
+# Streaming NDJSON responses - documents are encoded and sent as the cursor yields batches
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_BATCH_SIZE = int(os.environ.get('NDJSON_BATCH_SIZE', '100'))
+
+def wants_ndjson(request: Optional[Request]) -> bool:
+    return request is not None and NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+async def iter_ndjson(cursor, encode):
+    """Yield one NDJSON line per document without materializing the result set"""
+    async for doc in cursor.batch_size(NDJSON_BATCH_SIZE):
+        yield encode(doc) + "\n"
+
+async def iter_chat_history_ndjson(community_id: str, limit: int):
+    """Stream the latest `limit` chat messages in chronological order"""
+    if limit <= chat_buffer.size:
+        for entry in await chat_buffer.recent(community_id, limit):
+            yield json.dumps(entry) + "\n"
+        return
+    if CHAT_STORAGE == 'buckets':
+        async for msg in chat_bucket_store.iter_latest(community_id, limit):
+            yield json.dumps(serialize_live_chat(msg)) + "\n"
+        return
+    
+    # Find the oldest message in the window, then stream forward from it
+    query = {"community_id": community_id}
+    boundary = await db.live_chat.find(query, {"created_at": 1}).sort("created_at", -1).skip(limit - 1).limit(1).to_list(length=1)
+    if boundary:
+        query["created_at"] = {"$gte": boundary[0]["created_at"]}
+    cursor = db.live_chat.find(query).sort("created_at", 1)
+    async for line in iter_ndjson(cursor, lambda msg: json.dumps(serialize_live_chat(msg))):
+        yield line
+
+async def iter_community_export(community_id: str):
+    """Stream every post and live chat message of a community, tagged by kind"""
+    posts = db.posts.find({"community_id": community_id}, {"_id": 0}).sort("created_at", 1)
+    async for line in iter_ndjson(posts, lambda doc: json.dumps({"kind": "post", **doc}, default=str)):
+        yield line
+    if CHAT_STORAGE == 'buckets':
+        async for msg in chat_bucket_store.iter_messages(community_id):
+            yield json.dumps({"kind": "live_chat", **msg}, default=str) + "\n"
+        return
+    messages = db.live_chat.find({"community_id": community_id}, {"_id": 0}).sort("created_at", 1)
+    async for line in iter_ndjson(messages, lambda doc: json.dumps({"kind": "live_chat", **doc}, default=str)):
+        yield line
+
+# Data retention - expired documents are archived to gzipped NDJSON partitioned by date, then deleted
+ARCHIVE_DIR = Path(os.environ.get('ARCHIVE_DIR', str(ROOT_DIR / 'archive')))
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '1000'))
+RETENTION_DELETE_CHUNK = int(os.environ.get('RETENTION_DELETE_CHUNK', '200'))
+RETENTION_DELETE_PAUSE_SECONDS = float(os.environ.get('RETENTION_DELETE_PAUSE_SECONDS', '0.1'))
+
+def _retention_policy(name: str, field: str, default_days: int, default_archive: bool, query: Optional[dict] = None) -> dict:
+    """Policy for one collection - RETENTION_<NAME>_DAYS (0 keeps everything) and RETENTION_<NAME>_ARCHIVE"""
+    prefix = f"RETENTION_{name.upper()}"
+    return {
+        "days": int(os.environ.get(f"{prefix}_DAYS", str(default_days))),
+        "archive": os.environ.get(f"{prefix}_ARCHIVE", str(default_archive)).lower() == 'true',
+        "field": field,
+        "query": query or {}
+    }
+
+RETENTION_POLICIES = {
+    "live_chat": _retention_policy("live_chat", "created_at", 180, True),
+    "live_chat_buckets": _retention_policy("live_chat", "last_at", 180, True),  # whole buckets expire with their newest message
+    "chat_history": _retention_policy("chat_history", "created_at", 30, False),
+    "moderation_reports": _retention_policy("moderation_reports", "created_at", 365, True, {"is_resolved": True}),
+}
+
+def _retention_query(policy: dict, now: datetime) -> tuple:
+    cutoff = (now - timedelta(days=policy["days"])).isoformat()
+    return {**policy["query"], policy["field"]: {"$lt": cutoff}}, cutoff
+
+async def retention_report(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Dry run - documents and BSON bytes each policy would remove, per day"""
+    now = now or datetime.now(timezone.utc)
+    report = {}
+    for name, policy in RETENTION_POLICIES.items():
+        if policy["days"] <= 0:
+            continue
+        query, cutoff = _retention_query(policy, now)
+        days = await db[name].aggregate([
+            {"$match": query},
+            {"$group": {
+                "_id": {"$substrBytes": [f"${policy['field']}", 0, 10]},
+                "documents": {"$sum": 1},
+                "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}
+            }},
+            {"$sort": {"_id": 1}}
+        ]).to_list(length=None)
+        report[name] = {
+            "cutoff": cutoff,
+            "archive": policy["archive"],
+            "documents": sum(day["documents"] for day in days),
+            "bytes": sum(day["bytes"] for day in days),
+            "days": {day["_id"]: {"documents": day["documents"], "bytes": day["bytes"]} for day in days}
+        }
+    return report
+
+def _write_archive_batch(collection: str, run_id: str, lines_by_day: Dict[str, List[str]]) -> List[str]:
+    """Append one batch to <ARCHIVE_DIR>/<collection>/<YYYY-MM-DD>/<run_id>.ndjson.gz (runs in a worker thread)"""
+    paths = []
+    for day, lines in lines_by_day.items():
+        path = ARCHIVE_DIR / collection / day / f"{run_id}.ndjson.gz"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as out:
+                out.write("".join(lines).encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+        paths.append(str(path))
+    return paths
+
+async def _delete_in_chunks(collection, ids: list) -> int:
+    """Delete by _id a chunk at a time, pausing in between so replication and the cache can keep up"""
+    deleted = 0
+    for start in range(0, len(ids), RETENTION_DELETE_CHUNK):
+        result = await collection.delete_many({"_id": {"$in": ids[start:start + RETENTION_DELETE_CHUNK]}})
+        deleted += result.deleted_count
+        await asyncio.sleep(RETENTION_DELETE_PAUSE_SECONDS)
+    return deleted
+
+async def apply_retention(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Archive (when the policy says so) and delete expired documents, one batch at a time.
+
+    Each batch is written and fsynced before any of it is deleted, so an interrupted run
+    loses nothing; re-running it archives the unfinished batch again under a new run id.
+    """
+    now = now or datetime.now(timezone.utc)
+    run_id = now.strftime("%Y%m%dT%H%M%SZ")
+    summary = {}
+    for name, policy in RETENTION_POLICIES.items():
+        if policy["days"] <= 0:
+            continue
+        query, cutoff = _retention_query(policy, now)
+        collection = db[name]
+        archived = deleted = 0
+        files = set()
+        while True:
+            batch = await collection.find(query).sort("_id", 1).limit(RETENTION_BATCH_SIZE).to_list(length=None)
+            if not batch:
+                break
+            if policy["archive"]:
+                lines_by_day: Dict[str, List[str]] = {}
+                for doc in batch:
+                    day = str(doc.get(policy["field"], ""))[:10] or "unknown"
+                    lines_by_day.setdefault(day, []).append(json.dumps(doc, default=str) + "\n")
+                files.update(await asyncio.to_thread(_write_archive_batch, name, run_id, lines_by_day))
+                archived += len(batch)
+            deleted += await _delete_in_chunks(collection, [doc["_id"] for doc in batch])
+        summary[name] = {"cutoff": cutoff, "archived": archived, "deleted": deleted, "files": sorted(files)}
+        if deleted:
+            logger.info("Retention removed %d %s documents older than %s", deleted, name, cutoff)
+    return summary
+
+# LLM provider circuit breaker - shared by every LLM call site
+llm_breaker = CircuitBreaker(
+    window_seconds=float(os.environ.get('LLM_BREAKER_WINDOW_SECONDS', '60')),
+    min_calls=int(os.environ.get('LLM_BREAKER_MIN_CALLS', '10')),
+    error_rate=float(os.environ.get('LLM_BREAKER_ERROR_RATE', '0.5')),
+    slow_rate=float(os.environ.get('LLM_BREAKER_SLOW_RATE', '0.5')),
+    cooldown_seconds=float(os.environ.get('LLM_BREAKER_COOLDOWN_SECONDS', '30'))
+)
+# A call counts as slow once it used this share of its own call site's timeout
+LLM_BREAKER_SLOW_FRACTION = float(os.environ.get('LLM_BREAKER_SLOW_FRACTION', '0.8'))
+
+llm_scheduler = LLMScheduler(
+    max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', '16')),
+    class_limits={
+        "panic": int(os.environ.get('LLM_PANIC_CONCURRENCY', '16')),
+        "companion": int(os.environ.get('LLM_COMPANION_CONCURRENCY', '10')),
+        "moderation": int(os.environ.get('LLM_MODERATION_CONCURRENCY', '4'))
+    },
+    min_call_seconds=float(os.environ.get('LLM_MIN_CALL_SECONDS', '1.0'))
+)
+
+class LatencyHistogram:
+    """Streaming latency sketch with log-spaced buckets.
+
+    Quantiles are accurate to one bucket width (~10%). Counts are halved every
+    `decay_every` observations so the sketch follows current provider behaviour.
+    """
+
+    def __init__(self, min_seconds: float = 0.05, max_seconds: float = 300.0, growth: float = 1.1, decay_every: int = 500):
+        self.min_seconds = min_seconds
+        self.growth = growth
+        self.log_growth = math.log(growth)
+        self.buckets = [0.0] * (int(math.log(max_seconds / min_seconds) / self.log_growth) + 2)
+        self.decay_every = decay_every
+        self.count = 0.0
+        self.observed = 0
+
+    def observe(self, seconds: float):
+        index = 0 if seconds <= self.min_seconds else int(math.log(seconds / self.min_seconds) / self.log_growth) + 1
+        self.buckets[min(index, len(self.buckets) - 1)] += 1
+        self.count += 1
+        self.observed += 1
+        if self.observed % self.decay_every == 0:
+            self.buckets = [count / 2 for count in self.buckets]
+            self.count /= 2
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile"""
+        target = q * self.count
+        cumulative = 0.0
+        for index, count in enumerate(self.buckets):
+            cumulative += count
+            if cumulative >= target and count:
+                return self.min_seconds * self.growth ** index
+        return self.min_seconds * self.growth ** (len(self.buckets) - 1)
+
+class AdaptiveTimeouts:
+    """Per call site and model LLM deadlines derived from observed latency.
+
+    Each call's timeout is the target percentile of recent latency, clamped to the
+    call site's bounds; until enough samples exist the site's default is used. Calls
+    that time out are recorded above their timeout so that frequent timeouts push the
+    percentile (and the next deadline) upwards instead of pinning it.
+    """
+
+    def __init__(self, percentile: float, min_samples: int, bounds: Dict[str, Dict[str, float]]):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.bounds = bounds
+        self.histograms: Dict[tuple, LatencyHistogram] = {}
+        self.counters: Dict[tuple, Dict[str, int]] = {}
+
+    def _counters(self, key: tuple) -> Dict[str, int]:
+        return self.counters.setdefault(key, {"calls": 0, "timeouts": 0, "fallbacks": 0})
+
+    def timeout(self, call_site: str, model: str) -> float:
+        bounds = self.bounds[call_site]
+        histogram = self.histograms.get((call_site, model))
+        if histogram is None or histogram.count < self.min_samples:
+            return bounds["default"]
+        return min(max(histogram.quantile(self.percentile), bounds["min"]), bounds["max"])
+
+    def observe(self, call_site: str, model: str, seconds: float, timed_out: bool = False):
+        key = (call_site, model)
+        histogram = self.histograms.setdefault(key, LatencyHistogram())
+        histogram.observe(seconds * 1.5 if timed_out else seconds)
+        counters = self._counters(key)
+        counters["calls"] += 1
+        if timed_out:
+            counters["timeouts"] += 1
+
+    def record_fallback(self, call_site: str, model: str):
+        self._counters((call_site, model))["fallbacks"] += 1
+
+    def snapshot(self) -> dict:
+        result = {}
+        for (call_site, model), counters in self.counters.items():
+            histogram = self.histograms.get((call_site, model))
+            has_samples = histogram is not None and histogram.count
+            result[f"{call_site}:{model}"] = {
+                **counters,
+                "p50_seconds": round(histogram.quantile(0.5), 3) if has_samples else None,
+                "p95_seconds": round(histogram.quantile(0.95), 3) if has_samples else None,
+                "timeout_seconds": round(self.timeout(call_site, model), 3)
+            }
+        return result
+
+def _timeout_bounds(call_site: str, default: float, minimum: float, maximum: float) -> Dict[str, float]:
+    prefix = f"LLM_TIMEOUT_{call_site.upper()}"
+    return {
+        "default": float(os.environ.get(f"{prefix}_DEFAULT", str(default))),
+        "min": float(os.environ.get(f"{prefix}_MIN", str(minimum))),
+        "max": float(os.environ.get(f"{prefix}_MAX", str(maximum)))
+    }
+
+llm_timeouts = AdaptiveTimeouts(
+    percentile=float(os.environ.get('LLM_TIMEOUT_PERCENTILE', '0.95')),
+    min_samples=int(os.environ.get('LLM_TIMEOUT_MIN_SAMPLES', '20')),
+    bounds={
+        "panic": _timeout_bounds("panic", 3.0, 1.5, 5.0),
+        "companion": _timeout_bounds("companion", 30.0, 5.0, 60.0),
+        "moderation": _timeout_bounds("moderation", 10.0, 2.0, 15.0)
+    }
+)
+
+LLM_PROVIDER = "openai"
+LLM_MODEL = "gpt-5"
+
+async def call_llm(chat: LlmChat, user_message: UserMessage, priority: str = "companion", user_id: str = "anonymous", model: str = LLM_MODEL) -> str:
+    """Send a message to the LLM through the circuit breaker and the priority scheduler.
+
+    The timeout comes from the adaptive controller for this call site and model, and
+    covers both the time spent queued and the provider call itself.
+    """
+    if not llm_breaker.allow():
+        llm_timeouts.record_fallback(priority, model)
+        raise LLMUnavailableError("LLM circuit breaker is open")
+    
+    timeout = llm_timeouts.timeout(priority, model)
+    deadline = time.monotonic() + timeout
+    try:
+        await llm_scheduler.acquire(priority, user_id, deadline)
+    except BaseException as e:
+        llm_breaker.release()
+        if isinstance(e, Exception):
+            llm_timeouts.record_fallback(priority, model)
+        raise
+    
+    start = time.monotonic()
+    slow_after = timeout * LLM_BREAKER_SLOW_FRACTION
+    try:
+        with trace_span("llm.send_message", call_site=priority, model=model):
+            response = await asyncio.wait_for(chat.send_message(user_message), timeout=max(0.0, deadline - start))
+    except asyncio.CancelledError:
+        llm_breaker.release()
+        raise
+    except Exception as e:
+        elapsed = time.monotonic() - start
+        llm_breaker.record(False, elapsed, slow_after)
+        if isinstance(e, asyncio.TimeoutError):
+            llm_timeouts.observe(priority, model, elapsed, timed_out=True)
+        llm_timeouts.record_fallback(priority, model)
+        raise
+    finally:
+        llm_scheduler.release(priority)
+    
+    elapsed = time.monotonic() - start
+    llm_breaker.record(True, elapsed, slow_after)
+    llm_timeouts.observe(priority, model, elapsed)
+    return response
+
+async def moderate_content(content: str, user_id: str = "anonymous") -> Dict[str, Any]:
     """Basic content moderation using AI"""
     try:
         system_message = """You are a content moderator for a mental health support platform. Check if this message violates our community guidelines:
@@ -233,10 +1741,10 @@ async def moderate_content(content: str) -> Dict[str, Any]:
             api_key=os.environ['EMERGENT_LLM_KEY'],
             session_id=f"moderation_{uuid.uuid4()}",
             system_message=system_message
-        ).with_model("openai", "gpt-5")
+        ).with_model(LLM_PROVIDER, LLM_MODEL)
         
         user_message = UserMessage(text=content)
-        response = await asyncio.wait_for(chat.send_message(user_message), timeout=10.0)
+        response = await call_llm(chat, user_message, priority="moderation", user_id=user_id)
         
         # Try to parse JSON response
         import json
@@ -250,7 +1758,7 @@ async def moderate_content(content: str) -> Dict[str, Any]:
             return {"is_appropriate": True, "reason": "Content appears appropriate", "severity": "low"}
             
     except Exception as e:
-        logging.error(f"Moderation error: {e}")
+        logging.error("Moderation error: %s", e)
         # Conservative fallback - flag suspicious content
         suspicious_words = ['politics', 'government', 'damn', 'shit', 'fuck', 'asshole']
         if any(word in content.lower() for word in suspicious_words):
@@ -267,20 +1775,203 @@ async def get_current_user(request: Request = None) -> Optional[User]:
         return None
     
     try:
-        # Check session in database
-        session_data = await db.sessions.find_one({"session_token": session_token})
-        if not session_data or datetime.now(timezone.utc) > datetime.fromisoformat(session_data['expires_at'].replace('Z', '+00:00')):
-            return None
+        with trace_span("auth.get_current_user"):
+            # Check session in database
+            session_data = await db.sessions.find_one({"session_token": session_token})
+            if not session_data or datetime.now(timezone.utc) > datetime.fromisoformat(session_data['expires_at'].replace('Z', '+00:00')):
+                return None
         
-        # Get user data
-        user_data = await db.users.find_one({"id": session_data['user_id']})
-        if user_data and not user_data.get('is_banned', False):
-            return User(**parse_from_mongo(user_data))
-        return None
+            # Get user data
+            user_data = await db.users.find_one({"id": session_data['user_id']})
+            if user_data and not user_data.get('is_banned', False):
+                return User(**parse_from_mongo(user_data))
+            return None
     except Exception as e:
-        logging.error(f"Error getting current user: {e}")
+        logging.error("Error getting current user: %s", e)
         return None
 
+# Event loop watchdog - catches synchronous calls that block async handlers
+class LoopWatchdog:
+    """Measures event-loop lag and captures the blocking stack when the loop stalls.
+
+    A heartbeat callback is rescheduled on the loop every `interval` seconds and
+    records how late it ran. A daemon thread checks the last heartbeat; when it is
+    more than `threshold` seconds overdue, the loop thread's current stack (i.e. the
+    code that is blocking it) is captured together with the route being served, and
+    logged once per stall. Cost is one timer callback and one thread wake-up per
+    interval, so it can stay on in production.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_beat = time.monotonic()
+        self.lag_ewma = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_stall: Optional[dict] = None
+        self._loop = None
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        loop.call_soon(self._beat, self.last_beat)
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _beat(self, expected: float):
+        now = time.monotonic()
+        lag = max(0.0, now - expected)
+        self.lag_ewma = 0.9 * self.lag_ewma + 0.1 * lag
+        self.max_lag = max(self.max_lag, lag)
+        self.last_beat = now
+        if not self._stop.is_set():
+            self._loop.call_later(self.interval, self._beat, now + self.interval)
+
+    def _watch(self):
+        stalled_since = None
+        while not self._stop.wait(self.interval):
+            overdue = time.monotonic() - self.last_beat - self.interval
+            if overdue > self.threshold:
+                if stalled_since is None:
+                    stalled_since = self.last_beat
+                    self._report(overdue)
+            elif stalled_since is not None:
+                logging.warning("Event loop recovered after a %.0fms stall", (self.last_beat - stalled_since) * 1000)
+                stalled_since = None
+
+    @staticmethod
+    def _find_route(frame) -> Optional[str]:
+        """Walk up the blocked stack to the ASGI scope of the request being served"""
+        while frame is not None:
+            scope = frame.f_locals.get("scope")
+            if isinstance(scope, dict) and "path" in scope:
+                return f"{scope.get('method', 'WS')} {scope['path']}"
+            frame = frame.f_back
+        return None
+
+    def _report(self, overdue: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.format_stack(frame)[-20:]
+        route = self._find_route(frame)
+        self.stalls += 1
+        self.last_stall = {
+            "route": route,
+            "blocked_ms": round(overdue * 1000),
+            "at": datetime.now(timezone.utc).isoformat(),
+            "stack": [line.strip() for line in stack]
+        }
+        logging.warning("Event loop blocked for %.0fms+ while serving %s:\n%s", overdue * 1000, route or "unknown route", "".join(stack))
+
+    def snapshot(self) -> dict:
+        return {
+            "lag_ms": round(self.lag_ewma * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "stalls": self.stalls,
+            "last_stall": self.last_stall
+        }
+
+loop_watchdog = LoopWatchdog(
+    interval=float(os.environ.get('LOOP_WATCHDOG_INTERVAL_MS', '100')) / 1000,
+    threshold=float(os.environ.get('LOOP_STALL_THRESHOLD_MS', '250')) / 1000
+)
+
+# On-demand sampling profiler - registered only when PROFILING_ENABLED=true
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '60'))
+
+class SamplingProfiler:
+    """Statistical profiler that samples one thread's stack from a background thread.
+
+    Stacks are aggregated in collapsed form (`outer;inner;leaf count` per line), which
+    flamegraph.pl, speedscope and most flamegraph viewers load directly. Only the
+    sampled thread's frames are walked, so overhead is proportional to the sampling
+    rate, not to the amount of work being profiled.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: Dict[str, int] = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks"""
+        self._stop.set()
+        self._thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.counts.items())) + "\n"
+
+profiler_lock = asyncio.Lock()
+recent_profiles: "OrderedDict[str, str]" = OrderedDict()
+
+if PROFILING_ENABLED:
+    @app.middleware("http")
+    async def profile_request_middleware(request: Request, call_next):
+        """Profile the worker while an admin's request marked `X-Profile: 1` runs.
+
+        Samples come from the event loop thread, so the profile covers everything the
+        worker ran meanwhile (other requests, background flushes), not only this request.
+        Send it to an otherwise idle worker for a per-request picture.
+        """
+        if request.headers.get("x-profile") != "1":
+            return await call_next(request)
+        try:
+            await require_admin(request)
+        except HTTPException:
+            return await call_next(request)
+        
+        profiler = SamplingProfiler(threading.get_ident(), PROFILE_INTERVAL)
+        profiler.start()
+        try:
+            response = await call_next(request)
+        finally:
+            collapsed = profiler.stop()
+        
+        profile_id = uuid.uuid4().hex
+        recent_profiles[profile_id] = collapsed
+        while len(recent_profiles) > 20:
+            recent_profiles.popitem(last=False)
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
+
+async def require_admin(request: Request) -> User:
+    """Return the current user if they are a platform admin (listed in ADMIN_EMAILS)"""
+    current_user = await get_current_user(request)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 # Authentication Endpoints
 @api_router.post("/auth/session")
 async def process_session(x_session_id: Optional[str] = Header(None, alias="X-Session-ID")):
@@ -290,10 +1981,10 @@ async def process_session(x_session_id: Optional[str] = Header(None, alias="X-Se
     
     try:
         # Get session data from Emergent Auth
-        response = requests.get(
-            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-            headers={"X-Session-ID": x_session_id}
-        )
+        auth_url = "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data"
+        with trace_span("http.GET", url=auth_url):
+            async with httpx.AsyncClient(timeout=10.0) as http_client:
+                response = await http_client.get(auth_url, headers={"X-Session-ID": x_session_id})
         
         if response.status_code != 200:
             raise HTTPException(status_code=400, detail="Invalid session ID")
@@ -356,7 +2047,7 @@ async def process_session(x_session_id: Optional[str] = Header(None, alias="X-Se
         return response
         
     except Exception as e:
-        logging.error(f"Session processing error: {e}")
+        logging.error("Session processing error: %s", e)
         raise HTTPException(status_code=500, detail="Session processing failed")
 
 @api_router.post("/auth/logout")
@@ -378,12 +2069,146 @@ async def get_current_user_info(request: Request):
         raise HTTPException(status_code=401, detail="Not authenticated")
     return current_user
 
+# Bootstrap Endpoint
+def community_view(doc: dict) -> Community:
+    """A stored community with its live counters and activity scores"""
+    return Community(**{**community_counters.live_stats(parse_from_mongo(doc)), **activity_ranking.view(doc["id"])})
+
+async def load_communities(sort: Optional[str] = None) -> List[Community]:
+    """All communities, in insertion order or sorted by `active` or `trending` score"""
+    communities = [community_view(community) for community in await db.communities.find().to_list(length=None)]
+    if sort == "active":
+        communities.sort(key=lambda community: community.activity_score, reverse=True)
+    elif sort == "trending":
+        communities.sort(key=lambda community: community.trending_score, reverse=True)
+    return communities
+
+async def load_recent_posts(community_id: str, limit: int) -> List[Post]:
+    posts = await db.posts.find(
+        {"community_id": community_id, "is_flagged": False}
+    ).sort("created_at", -1).limit(limit).to_list(length=None)
+    return [Post(**hide_anonymous_author(parse_from_mongo(post))) for post in posts]
+
+@api_router.get("/bootstrap")
+async def bootstrap(request: Request, community_id: Optional[str] = None, posts_limit: int = 20, chat_limit: int = 20, sort: Optional[str] = None):
+    """Everything the app needs on start in one round trip - the user, the community list and,
+    when `community_id` is given, the first page of its posts and chat"""
+    if community_id:
+        current_user, communities, posts, chat_messages = await asyncio.gather(
+            get_current_user(request),
+            load_communities(sort),
+            load_recent_posts(community_id, posts_limit),
+            chat_buffer.recent(community_id, chat_limit)
+        )
+    else:
+        current_user, communities = await asyncio.gather(get_current_user(request), load_communities(sort))
+        posts, chat_messages = [], []
+    
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    return {
+        "user": current_user,
+        "communities": communities,
+        "community_id": community_id,
+        "posts": posts,
+        "chat_messages": chat_messages
+    }
+
+# Delta Sync Endpoint
+SYNC_PAGE_LIMIT = int(os.environ.get('SYNC_PAGE_LIMIT', '500'))
+SYNC_OVERLAP_SECONDS = float(os.environ.get('SYNC_OVERLAP_SECONDS', '5'))
+SYNC_EPOCH = "1970-01-01T00:00:00+00:00"
+
+def encode_sync_token(timestamp: str, overlap: bool = True) -> str:
+    payload = {"v": 1, "t": timestamp, "o": overlap}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+def decode_sync_token(token: Optional[str]) -> tuple:
+    """Return (timestamp, overlap) - overlap is off while paging through a truncated result"""
+    if not token:
+        return SYNC_EPOCH, False
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        timestamp = datetime.fromisoformat(data["t"])
+        if timestamp.tzinfo is None:
+            raise ValueError("sync token timestamp has no timezone")
+        return data["t"], bool(data.get("o", True))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+async def backfill_updated_at():
+    """Give communities and posts stored before updated_at existed one, so a first sync finds them"""
+    stamp = [{"$set": {"updated_at": {"$ifNull": ["$created_at", SYNC_EPOCH]}}}]
+    for collection in (db.communities, db.posts):
+        result = await collection.update_many({"updated_at": {"$exists": False}}, stamp)
+        if result.modified_count:
+            logger.info("Backfilled updated_at on %d %s documents", result.modified_count, collection.name)
+
+async def _changed_since(collection, query: dict, field: str, since: str) -> List[dict]:
+    return await collection.find(
+        {**query, field: {"$gte": since}}, {"_id": 0}
+    ).sort(field, 1).limit(SYNC_PAGE_LIMIT).to_list(length=None)
+
+@api_router.get("/sync")
+async def sync_changes(request: Request, since: Optional[str] = None, community_ids: Optional[str] = None):
+    """Return what changed since the `since` token: communities, plus posts and chat for the
+    comma-separated `community_ids`. Flagged posts come back as tombstones; chat removed by
+    retention is not reported, since it is far older than the recent history clients hold.
+
+    Each query re-reads a short overlap window before the token so writes that commit out of
+    order are not missed; clients apply changes by id, so repeats are harmless. When any list
+    is truncated `has_more` is set and the client should call again with the new token.
+    """
+    current_user = await get_current_user(request)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    token_time, overlap = decode_sync_token(since)
+    query_from = token_time
+    if overlap:
+        query_from = (datetime.fromisoformat(token_time) - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat()
+    requested_ids = [cid for cid in (community_ids or "").split(",") if cid]
+    scoped = {"community_id": {"$in": requested_ids}}
+    if CHAT_STORAGE == 'buckets':
+        chat_changes = chat_bucket_store.changed_since(requested_ids, query_from, SYNC_PAGE_LIMIT)
+    else:
+        chat_changes = _changed_since(db.live_chat, scoped, "created_at", query_from)
+    
+    communities, posts, chat_messages = await asyncio.gather(
+        _changed_since(db.communities, {}, "updated_at", query_from),
+        _changed_since(db.posts, scoped, "updated_at", query_from),
+        chat_changes
+    )
+    
+    # Advance the token to the newest change seen - or only as far as the shortest truncated list
+    batches = [(communities, "updated_at"), (posts, "updated_at"), (chat_messages, "created_at")]
+    has_more = any(len(docs) >= SYNC_PAGE_LIMIT for docs, _ in batches)
+    if has_more:
+        next_time = min(docs[-1][field] for docs, field in batches if len(docs) >= SYNC_PAGE_LIMIT)
+    else:
+        next_time = max([token_time] + [docs[-1][field] for docs, field in batches if docs])
+    
+    removed = [{"kind": "post", "id": post["id"], "community_id": post["community_id"]} for post in posts if post.get("is_flagged")]
+    
+    return {
+        "communities": [community_view(doc) for doc in communities],
+        "posts": [Post(**hide_anonymous_author(parse_from_mongo(post))) for post in posts if not post.get("is_flagged")],
+        "chat_messages": [serialize_live_chat(msg) for msg in chat_messages],
+        "tombstones": removed,
+        "token": encode_sync_token(next_time, overlap=not has_more),
+        "has_more": has_more
+    }
+
 # Community Endpoints
 @api_router.get("/communities", response_model=List[Community])
-async def get_communities():
-    """Get all communities"""
-    communities = await db.communities.find().to_list(length=None)
-    return [Community(**parse_from_mongo(community)) for community in communities]
+async def get_communities(request: Request, sort: Optional[str] = None):
+    """Get all communities - `sort=active` or `sort=trending` orders them by in-memory activity scores"""
+    if wants_ndjson(request) and not sort:
+        lines = iter_ndjson(db.communities.find(), lambda doc: community_view(doc).json())
+        return StreamingResponse(lines, media_type=NDJSON_MEDIA_TYPE)
+    
+    return await load_communities(sort)
 
 @api_router.post("/communities", response_model=Community)
 async def create_community(community_data: CommunityCreate, request: Request):
@@ -410,11 +2235,23 @@ async def create_community(community_data: CommunityCreate, request: Request):
     await db.communities.insert_one(community_dict)
     return new_community
 
+POST_BLOCKED_WORDS = ["politics", "trump", "biden", "election", "government", "fuck", "shit", "damn"]
+
+def check_post_content(text: str):
+    """Simple content filter for inappropriate content in posts and replies"""
+    if any(word in text.lower() for word in POST_BLOCKED_WORDS):
+        raise HTTPException(status_code=400, detail="Content violates community guidelines: No politics or excessive profanity allowed")
+
 @api_router.get("/communities/{community_id}/posts", response_model=List[Post])
-async def get_community_posts(community_id: str):
+async def get_community_posts(community_id: str, request: Request):
     """Get posts for a specific community"""
+    if wants_ndjson(request):
+        cursor = db.posts.find({"community_id": community_id, "is_flagged": False})
+        lines = iter_ndjson(cursor, lambda doc: Post(**reaction_buffer.with_pending("post", hide_anonymous_author(parse_from_mongo(doc)))).json())
+        return StreamingResponse(lines, media_type=NDJSON_MEDIA_TYPE)
+    
     posts = await db.posts.find({"community_id": community_id, "is_flagged": False}).to_list(length=None)
-    return [Post(**parse_from_mongo(post)) for post in posts]
+    return [Post(**reaction_buffer.with_pending("post", hide_anonymous_author(parse_from_mongo(post)))) for post in posts]
 
 @api_router.post("/communities/{community_id}/posts", response_model=Post)
 async def create_post(community_id: str, post_data: PostCreate, request: Request = None):
@@ -435,12 +2272,7 @@ async def create_post(community_id: str, post_data: PostCreate, request: Request
     if not post_data.title.strip() or not post_data.content.strip():
         raise HTTPException(status_code=400, detail="Title and content are required")
     
-    # Simple content filter for inappropriate content
-    blocked_words = ["politics", "trump", "biden", "election", "government", "fuck", "shit", "damn"]
-    content_to_check = f"{post_data.title} {post_data.content}".lower()
-    
-    if any(word in content_to_check for word in blocked_words):
-        raise HTTPException(status_code=400, detail="Content violates community guidelines: No politics or excessive profanity allowed")
+    check_post_content(f"{post_data.title} {post_data.content}")
     
     new_post = Post(
         community_id=community_id,
@@ -452,34 +2284,278 @@ async def create_post(community_id: str, post_data: PostCreate, request: Request
     )
     post_dict = prepare_for_mongo(new_post.dict())
     await db.posts.insert_one(post_dict)
-    return new_post
+    if post_search_index is not None:
+        post_search_index.add(post_dict)
+    community_counters.record_post(community_id, post_dict["created_at"])
+    activity_ranking.record(community_id, "post")
+    if current_user:
+        community_counters.record_member(community_id, current_user.id)
+    return Post(**hide_anonymous_author(new_post.dict()))
+
+@api_router.post("/communities/{community_id}/read")
+async def mark_community_read(community_id: str, request: Request, positions: Optional[Dict[str, int]] = None):
+    """Mark a community read up to the given `post_seq`/`message_seq`, or up to now when none are given"""
+    current_user = await get_current_user(request)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    if not positions:
+        community = await db.communities.find_one({"id": community_id}, {"_id": 0, "id": 1, "post_seq": 1, "message_seq": 1})
+        if not community:
+            raise HTTPException(status_code=404, detail="Community not found")
+        positions = community_counters.sequences(community)
+    positions = {field: int(positions.get(field, 0)) for field in ("post_seq", "message_seq")}
+    read_markers.mark(current_user.id, community_id, positions)
+    return {"community_id": community_id, **positions}
+
+@api_router.get("/unread")
+async def get_unread_counts(request: Request):
+    """Unread posts and messages for every community the user belongs to, from two reads and a subtraction"""
+    current_user = await get_current_user(request)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    markers, memberships = await asyncio.gather(
+        read_markers.load(current_user.id),
+        db.community_members.find({"user_id": current_user.id}, {"_id": 0, "community_id": 1}).to_list(length=None)
+    )
+    community_ids = list({doc["community_id"] for doc in memberships} | set(markers))
+    communities = await db.communities.find(
+        {"id": {"$in": community_ids}}, {"_id": 0, "id": 1, "post_seq": 1, "message_seq": 1}
+    ).to_list(length=None)
+    
+    unread = {}
+    for community in communities:
+        current = community_counters.sequences(community)
+        seen = markers.get(community["id"], {"post_seq": 0, "message_seq": 0})
+        posts = max(0, current["post_seq"] - seen["post_seq"])
+        messages = max(0, current["message_seq"] - seen["message_seq"])
+        unread[community["id"]] = {**current, "posts": posts, "messages": messages, "total": posts + messages}
+    return unread
+
+# Reply Endpoints - threads are stored with materialized paths and read in path order
+MAX_REPLY_DEPTH = int(os.environ.get('MAX_REPLY_DEPTH', '8'))
+REPLY_PAGE_LIMIT = int(os.environ.get('REPLY_PAGE_LIMIT', '200'))
+
+def reply_path_segment() -> str:
+    """Fixed-width, time-ordered path segment so siblings sort oldest first"""
+    return f"{time.time_ns() // 1000:016d}{uuid.uuid4().hex[:4]}."
+
+@api_router.post("/posts/{post_id}/replies", response_model=Reply)
+async def create_reply(post_id: str, reply_data: ReplyCreate, request: Request = None):
+    """Reply to a post or to another reply - anonymous replies are allowed, as for posts"""
+    current_user = None
+    if request:
+        try:
+            current_user = await get_current_user(request)
+        except:
+            pass
+    author_id = current_user.id if current_user else f"anonymous_{uuid.uuid4().hex[:8]}"
+    
+    if not reply_data.content.strip():
+        raise HTTPException(status_code=400, detail="Reply content is required")
+    check_post_content(reply_data.content)
+    
+    post = await db.posts.find_one({"id": post_id, "is_flagged": False}, {"_id": 0, "id": 1, "community_id": 1})
+    if not post:
+        raise HTTPException(status_code=404, detail="Post not found")
+    
+    parent = None
+    path, depth = reply_path_segment(), 0
+    if reply_data.parent_id:
+        parent = await db.replies.find_one({"id": reply_data.parent_id, "post_id": post_id}, {"_id": 0, "id": 1, "parent_id": 1, "path": 1, "depth": 1})
+        if not parent:
+            raise HTTPException(status_code=404, detail="Parent reply not found")
+        if parent["depth"] + 1 >= MAX_REPLY_DEPTH:
+            # Too deep - attach next to the parent instead of under it
+            parent = await db.replies.find_one({"id": parent["parent_id"]}, {"_id": 0, "id": 1, "path": 1, "depth": 1}) if parent["parent_id"] else None
+        if parent:
+            path, depth = parent["path"] + path, parent["depth"] + 1
+    
+    reply = Reply(
+        post_id=post_id,
+        community_id=post["community_id"],
+        parent_id=parent["id"] if parent else None,
+        author_id=author_id,
+        content=reply_data.content,
+        is_anonymous=reply_data.is_anonymous if current_user else True,
+        path=path,
+        depth=depth
+    )
+    reply_dict = prepare_for_mongo(reply.dict())
+    await db.replies.insert_one(reply_dict)
+    await db.posts.update_one({"id": post_id}, {"$inc": {"reply_count": 1}, "$set": {"updated_at": reply_dict["created_at"]}})
+    if parent:
+        await db.replies.update_one({"id": parent["id"]}, {"$inc": {"reply_count": 1}})
+    community_counters.record(post["community_id"], at=reply_dict["created_at"])
+    activity_ranking.record(post["community_id"], "reply")
+    return Reply(**hide_anonymous_author(reply.dict()))
+
+@api_router.get("/posts/{post_id}/replies")
+async def get_replies(post_id: str, limit: int = 50, cursor: Optional[str] = None, parent_id: Optional[str] = None):
+    """A page of a post's thread (or of one reply's subtree) in display order - one indexed range query per page"""
+    limit = max(1, min(limit, REPLY_PAGE_LIMIT))
+    query: Dict[str, Any] = {"post_id": post_id}
+    if parent_id:
+        parent = await db.replies.find_one({"id": parent_id, "post_id": post_id}, {"_id": 0, "path": 1})
+        if not parent:
+            raise HTTPException(status_code=404, detail="Parent reply not found")
+        query["path"] = {"$regex": f"^{re.escape(parent['path'])}."}
+    if cursor:
+        query.setdefault("path", {})["$gt"] = decode_cursor(cursor)["path"]
+    
+    replies = await db.replies.find(query, {"_id": 0}).sort("path", 1).limit(limit + 1).to_list(length=None)
+    page = replies[:limit]
+    return {
+        "replies": [Reply(**hide_anonymous_author(parse_from_mongo(reply))) for reply in page if not reply.get("is_flagged")],
+        "next_cursor": encode_cursor({"path": page[-1]["path"]}) if len(replies) > limit else None
+    }
+
+# Reaction Endpoints
+def validate_reaction(reaction_request: ReactionRequest):
+    if reaction_request.target_type not in REACTION_TARGETS:
+        raise HTTPException(status_code=400, detail=f"target_type must be one of {REACTION_TARGETS}")
+    if reaction_request.reaction not in REACTION_TYPES:
+        raise HTTPException(status_code=400, detail=f"reaction must be one of {REACTION_TYPES}")
+
+@api_router.post("/reactions")
+async def add_reaction(reaction_request: ReactionRequest, request: Request):
+    """Send a supportive reaction to a post or chat message - repeating it has no effect"""
+    current_user = await get_current_user(request)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    validate_reaction(reaction_request)
+    
+    target_type, target_id = reaction_request.target_type, reaction_request.target_id
+    if not await reaction_target_exists(target_type, target_id):
+        raise HTTPException(status_code=404, detail=f"{target_type.capitalize()} not found")
+    already_given = await db.reactions.find_one({
+        "target_type": target_type,
+        "target_id": target_id,
+        "user_id": current_user.id,
+        "reaction": reaction_request.reaction
+    }, {"_id": 1})
+    if not already_given:
+        reaction_buffer.add(target_type, target_id, current_user.id, reaction_request.reaction)
+    stored = await load_reaction_counts(target_type, [target_id])
+    return {"status": "accepted", "reactions": reaction_buffer.counts(target_type, target_id, stored.get(target_id))}
+
+@api_router.delete("/reactions")
+async def remove_reaction(reaction_request: ReactionRequest, request: Request):
+    """Take back a reaction"""
+    current_user = await get_current_user(request)
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    validate_reaction(reaction_request)
+    
+    removed = await reaction_buffer.remove(reaction_request.target_type, reaction_request.target_id, current_user.id, reaction_request.reaction)
+    return {"status": "removed" if removed else "not_found"}
+
+@api_router.get("/reactions")
+async def get_reactions(target_type: str, ids: str):
+    """Reaction counts for the comma-separated `ids` (posts already carry theirs in the feed)"""
+    if target_type not in REACTION_TARGETS:
+        raise HTTPException(status_code=400, detail=f"target_type must be one of {REACTION_TARGETS}")
+    target_ids = [target_id for target_id in ids.split(",") if target_id][:200]
+    stored = await load_reaction_counts(target_type, target_ids)
+    return {target_id: reaction_buffer.counts(target_type, target_id, stored.get(target_id)) for target_id in target_ids}
+
+# Search Endpoints - Mongo text index or in-process inverted index, chosen by SEARCH_BACKEND
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'mongo')
+post_search_index = PostSearchIndex() if SEARCH_BACKEND == 'memory' else None
+
+def encode_cursor(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def build_post_search_index():
+    """Load existing posts into the in-process index, streaming from the cursor"""
+    cursor = db.posts.find(
+        {"is_flagged": False},
+        {"_id": 0, "id": 1, "title": 1, "content": 1, "community_id": 1, "support_type": 1}
+    ).batch_size(1000)
+    async for post in cursor:
+        post_search_index.add(post)
+    logger.info("Post search index built: %d posts, ~%d KB", post_search_index.live_count, post_search_index.memory_bytes() // 1024)
+
+@api_router.get("/search/posts")
+async def search_posts(q: str, community_id: Optional[str] = None, support_type: Optional[str] = None,
+                       cursor: Optional[str] = None, limit: int = 20):
+    """Ranked full-text search over posts, paginated with an opaque cursor. Flagged posts are never returned."""
+    limit = max(1, min(limit, 50))
+    if not q.strip():
+        return {"results": [], "next_cursor": None}
+    
+    if post_search_index is not None:
+        position = decode_cursor(cursor) if cursor else None
+        after = (position["s"], position["p"]) if position else None
+        ranked, next_position = post_search_index.search(q, community_id, support_type, limit, after)
+        docs = await db.posts.find({"id": {"$in": [post_id for post_id, _ in ranked]}, "is_flagged": False}).to_list(length=None)
+        by_id = {doc["id"]: doc for doc in docs}
+        results = [(by_id[post_id], score) for post_id, score in ranked if post_id in by_id]
+        next_cursor = encode_cursor({"s": next_position[0], "p": next_position[1]}) if next_position else None
+    else:
+        query = {"$text": {"$search": q}, "is_flagged": False}
+        if community_id:
+            query["community_id"] = community_id
+        if support_type:
+            query["support_type"] = support_type
+        pipeline = [{"$match": query}, {"$addFields": {"score": {"$meta": "textScore"}}}]
+        if cursor:
+            # Keyset on (score desc, id asc) - resume after the last result instead of skipping
+            position = decode_cursor(cursor)
+            pipeline.append({"$match": {"$or": [
+                {"score": {"$lt": position["s"]}},
+                {"score": position["s"], "id": {"$gt": position["p"]}}
+            ]}})
+        pipeline += [{"$sort": {"score": -1, "id": 1}}, {"$limit": limit + 1}, {"$project": {"_id": 0}}]
+        docs = await db.posts.aggregate(pipeline).to_list(length=None)
+        results = [(doc, doc.pop("score")) for doc in docs[:limit]]
+        next_cursor = encode_cursor({"s": results[-1][1], "p": results[-1][0]["id"]}) if len(docs) > limit else None
+    
+    return {
+        "results": [{**Post(**hide_anonymous_author(parse_from_mongo(doc))).dict(), "score": round(score, 4)} for doc, score in results],
+        "next_cursor": next_cursor
+    }
 
 # Live Chat Endpoints - HTTP-based fallback for reliable functionality
+CHAT_BLOCKED_WORDS = ["politics", "trump", "biden", "election", "government"]
+CHAT_REPLAY_LIMIT = int(os.environ.get('CHAT_REPLAY_LIMIT', '500'))
+CHAT_LONG_POLL_MAX_SECONDS = float(os.environ.get('CHAT_LONG_POLL_MAX_SECONDS', '30'))
+
 @api_router.get("/chat/{community_id}/messages")
-async def get_chat_messages(community_id: str, limit: int = 50):
+async def get_chat_messages(community_id: str, limit: int = 50, request: Request = None):
     """Get recent chat messages for a community"""
+    if wants_ndjson(request):
+        return StreamingResponse(iter_chat_history_ndjson(community_id, limit), media_type=NDJSON_MEDIA_TYPE)
+    
     try:
-        messages = await db.live_chat.find(
-            {"community_id": community_id}
-        ).sort("created_at", -1).limit(limit).to_list(length=None)
-        
-        # Reverse to get chronological order
-        messages.reverse()
-        
-        return [
-            {
-                "id": msg["id"],
-                "user_name": msg["user_name"] if not msg.get("is_anonymous", True) else f"Anonymous{msg['user_id'][-4:]}",
-                "message": msg["message"],
-                "timestamp": msg["created_at"],
-                "type": "message"
-            }
-            for msg in messages
-        ]
+        return await chat_buffer.recent(community_id, limit)
     except Exception as e:
-        logging.error(f"Error fetching chat messages: {e}")
+        logging.error("Error fetching chat messages: %s", e)
         return []
 
+@api_router.get("/chat/{community_id}/poll")
+async def poll_chat_messages(community_id: str, after_seq: int, timeout: float = 25.0):
+    """Long-poll for chat messages newer than `after_seq` - held open until one arrives or `timeout` elapses"""
+    timeout = max(0.0, min(timeout, CHAT_LONG_POLL_MAX_SECONDS))
+    try:
+        event = chat_waiters.current(community_id)
+        messages = await chat_buffer.since(community_id, after_seq, limit=CHAT_REPLAY_LIMIT)
+        if not messages and await chat_waiters.wait(community_id, event, timeout):
+            messages = await chat_buffer.since(community_id, after_seq, limit=CHAT_REPLAY_LIMIT)
+        
+        last_seq = max([after_seq] + [msg["seq"] for msg in messages])
+        return {"messages": messages, "last_seq": last_seq}
+    except Exception as e:
+        logging.error("Error long-polling chat messages: %s", e)
+        return {"messages": [], "last_seq": after_seq}
+
 @api_router.post("/chat/{community_id}/send")
 async def send_chat_message(community_id: str, message_data: Dict[str, Any], request: Request = None):
     """Send a message to community chat"""
@@ -491,8 +2567,7 @@ async def send_chat_message(community_id: str, message_data: Dict[str, Any], req
         message_content = message_data["message"].strip()
         
         # Content filtering
-        blocked_words = ["politics", "trump", "biden", "election", "government"]
-        if any(word.lower() in message_content.lower() for word in blocked_words):
+        if any(word in message_content.lower() for word in CHAT_BLOCKED_WORDS):
             raise HTTPException(status_code=400, detail="Political content is not allowed in our healing community")
         
         # Generate user info
@@ -500,30 +2575,117 @@ async def send_chat_message(community_id: str, message_data: Dict[str, Any], req
         user_name = message_data.get("user_name", f"Member{temp_user_id[-4:]}")
         
         # Store message
-        chat_message = LiveChatMessage(
-            community_id=community_id,
-            user_id=temp_user_id,
-            user_name=user_name,
-            message=message_content,
-            is_anonymous=message_data.get("is_anonymous", True)
+        entry = await store_live_chat_message(
+            community_id,
+            message_content,
+            temp_user_id,
+            user_name,
+            message_data.get("is_anonymous", True)
         )
         
-        chat_dict = prepare_for_mongo(chat_message.dict())
-        await db.live_chat.insert_one(chat_dict)
-        
         return {
             "status": "sent",
-            "message_id": chat_message.id,
-            "timestamp": chat_message.created_at.isoformat(),
-            "user_name": user_name if not chat_message.is_anonymous else f"Anonymous{temp_user_id[-4:]}"
+            "message_id": entry["id"],
+            "timestamp": entry["timestamp"],
+            "user_name": entry["user_name"]
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error sending chat message: {e}")
+        logging.error("Error sending chat message: %s", e)
         raise HTTPException(status_code=500, detail="Failed to send message")
 
+@api_router.websocket("/ws/chat/{community_id}")
+async def live_chat_websocket(websocket: WebSocket, community_id: str, user_name: Optional[str] = None, last_seq: Optional[int] = None, encoding: Optional[str] = None):
+    """Live chat over WebSocket - recent history is sent on join, then messages are broadcast.
+
+    Reconnecting clients pass `last_seq` (the highest `seq` they have seen) and only
+    receive the messages they missed in a `replay` frame. Clients may opt in to binary
+    MessagePack frames with `encoding=msgpack`; the default is JSON text. Clients send
+    `{"type": "typing"}` while composing (`"typing": false` to clear) and receive aggregate
+    `typing` frames listing who is typing.
+    """
+    # Messages and anonymous aliases use a random per-connection id, never the account id,
+    # so anonymous messages cannot be linked across rooms or sessions. The account id is
+    # only the presence key, so several tabs of one member count once.
+    member = await get_current_user(websocket)
+    user_id = f"user_{uuid.uuid4().hex[:8]}"
+    presence_id = member.id if member else user_id
+    user_name = user_name or f"Member{user_id[-4:]}"
+    encoding = negotiate_encoding(encoding)
+    request_id_var.set(uuid.uuid4().hex)
+    session_id_var.set(user_id)
+    await manager.connect(websocket, presence_id, user_name, community_id, encoding)
+    community_counters.record(community_id)
+    activity_ranking.record(community_id, "connection")
+    if member:
+        community_counters.record_member(community_id, member.id)
+    
+    try:
+        if last_seq is not None:
+            missed = await chat_buffer.since(community_id, last_seq, limit=CHAT_REPLAY_LIMIT)
+            await send_frame(websocket, encode_frame({
+                "type": "replay",
+                "messages": missed,
+                "complete": len(missed) < CHAT_REPLAY_LIMIT
+            }, encoding))
+        else:
+            history = await chat_buffer.recent(community_id)
+            await send_frame(websocket, encode_frame({"type": "history", "messages": history}, encoding))
+        await send_frame(websocket, encode_frame({"type": "presence", "online": presence.online(community_id), "joined": [], "left": []}, encoding))
+        
+        while True:
+            data = decode_frame(await websocket.receive())
+            if data.get("type") == "typing":
+                if data.get("typing", True):
+                    display_name = f"Anonymous{user_id[-4:]}" if data.get("is_anonymous", True) else data.get("user_name", user_name)
+                    typing_tracker.typing(community_id, user_id, display_name, time.monotonic())
+                else:
+                    typing_tracker.stopped(community_id, user_id)
+                continue
+            
+            message_content = str(data.get("message", "")).strip()
+            if not message_content:
+                continue
+            
+            if any(word in message_content.lower() for word in CHAT_BLOCKED_WORDS):
+                await send_frame(websocket, encode_frame({
+                    "type": "warning",
+                    "message": "Political content is not allowed in our healing community"
+                }, encoding))
+                continue
+            
+            entry = await store_live_chat_message(
+                community_id,
+                message_content,
+                user_id,
+                data.get("user_name", user_name),
+                data.get("is_anonymous", True)
+            )
+            typing_tracker.stopped(community_id, user_id)
+            await manager.broadcast_to_community(community_id, entry)
+    
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logging.error("Live chat WebSocket error: %s", e)
+    finally:
+        typing_tracker.stopped(community_id, user_id)
+        manager.disconnect(websocket)
+
+# Presence Endpoints
+@api_router.get("/presence")
+async def get_presence(community_ids: Optional[str] = None):
+    """Online counts for the comma-separated `community_ids`, or every room with someone online"""
+    if community_ids:
+        return {community_id: presence.online(community_id) for community_id in community_ids.split(",") if community_id}
+    return presence.snapshot()
+
+@api_router.get("/communities/{community_id}/presence")
+async def get_community_presence(community_id: str):
+    return {"community_id": community_id, "online": presence.online(community_id)}
+
 # AI Companion Endpoints
 @api_router.post("/ai/chat")
 async def chat_with_ai(chat_request: ChatRequest, request: Request):
@@ -566,10 +2728,10 @@ async def chat_with_ai(chat_request: ChatRequest, request: Request):
             api_key=os.environ['EMERGENT_LLM_KEY'],
             session_id=f"user_{current_user.id}_{uuid.uuid4()}",
             system_message=system_message
-        ).with_model("openai", "gpt-5")
+        ).with_model(LLM_PROVIDER, LLM_MODEL)
         
         user_message = UserMessage(text=chat_request.message)
-        response = await chat.send_message(user_message)
+        response = await call_llm(chat, user_message, priority="companion", user_id=current_user.id)
         
         # Store chat in database (don't block on this)
         try:
@@ -582,12 +2744,12 @@ async def chat_with_ai(chat_request: ChatRequest, request: Request):
             chat_dict = prepare_for_mongo(chat_message.dict())
             await db.chat_history.insert_one(chat_dict)
         except Exception as e:
-            logging.warning(f"Failed to store chat message: {e}")
+            logging.warning("Failed to store chat message: %s", e)
         
         return {"response": response, "is_panic_response": chat_request.is_panic}
         
     except Exception as e:
-        logging.error(f"AI chat error: {e}")
+        logging.error("AI chat error: %s", e)
         raise HTTPException(status_code=500, detail="AI companion temporarily unavailable")
 
 @api_router.post("/ai/panic-button")
@@ -639,28 +2801,30 @@ async def panic_button(panic_request: PanicButtonRequest):
                 api_key=os.environ['EMERGENT_LLM_KEY'],
                 session_id=f"panic_{panic_request.user_id}_{uuid.uuid4()}",
                 system_message=system_message
-            ).with_model("openai", "gpt-5")
+            ).with_model(LLM_PROVIDER, LLM_MODEL)
             
             user_message = UserMessage(text=f"I'm feeling {panic_request.severity} distress. {panic_request.trigger_description or ''}")
             
             # Set a short timeout for AI response to ensure immediate help
-            ai_response = await asyncio.wait_for(
-                chat.send_message(user_message), 
-                timeout=3.0  # Reduced from 5 to 3 seconds
+            ai_response = await call_llm(
+                chat, 
+                user_message, 
+                priority="panic",  # adaptive timeout, 3 seconds until enough samples exist
+                user_id=panic_request.user_id
             )
             emergency_response["ai_guidance"] = ai_response
             
-        except asyncio.TimeoutError:
-            logging.warning("AI response timeout during panic button - using fallback")
+        except (asyncio.TimeoutError, LLMUnavailableError):
+            logging.warning("AI response timeout or circuit open during panic button - using fallback")
             emergency_response["ai_guidance"] = "You are safe. Focus on your breathing. This moment will pass. You are stronger than you know. If you need personal support, contact Brent at circleofcaresupport@pm.me"
         except Exception as ai_error:
-            logging.error(f"AI error during panic: {ai_error}")
+            logging.error("AI error during panic: %s", ai_error)
             emergency_response["ai_guidance"] = "You are safe. Focus on your breathing. This moment will pass. You are stronger than you know. Contact support at circleofcaresupport@pm.me"
         
         return emergency_response
         
     except Exception as e:
-        logging.error(f"Critical panic button error: {e}")
+        logging.error("Critical panic button error: %s", e)
         # Always return immediate help even if everything fails
         return {
             "immediate_response": "You are safe. Take slow, deep breaths. This moment will pass. You are stronger than you know.",
@@ -698,6 +2862,42 @@ async def report_content(report_data: Dict, request: Request):
     
     return {"message": "Report submitted successfully. Our 24/7 moderation team will review it."}
 
+# Admin Endpoints
+@api_router.post("/admin/profile")
+async def profile_worker(request: Request, seconds: float = 10.0):
+    """Sample this worker's event loop for `seconds` and return collapsed stacks"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    await require_admin(request)
+    if profiler_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    
+    async with profiler_lock:
+        profiler = SamplingProfiler(threading.get_ident(), PROFILE_INTERVAL)
+        profiler.start()
+        try:
+            await asyncio.sleep(max(0.1, min(seconds, PROFILE_MAX_SECONDS)))
+        finally:
+            collapsed = profiler.stop()
+    return Response(content=collapsed, media_type="text/plain")
+
+@api_router.get("/admin/retention")
+async def get_retention_report(request: Request):
+    """Dry run of the retention policies - what would be archived and deleted right now"""
+    await require_admin(request)
+    return await retention_report()
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_request_profile(profile_id: str, request: Request):
+    """Fetch the collapsed stacks recorded for a request sent with `X-Profile: 1`"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    await require_admin(request)
+    collapsed = recent_profiles.get(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(content=collapsed, media_type="text/plain")
+
 # User Profile Endpoints
 @api_router.get("/profile")
 async def get_profile(request: Request):
@@ -720,8 +2920,79 @@ async def update_profile(profile_data: dict, request: Request):
     update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
     
     await db.users.update_one({"id": current_user.id}, {"$set": update_data})
+    user_cards.invalidate(current_user.id)
     return {"message": "Profile updated successfully"}
 
+# User Card Endpoints
+USER_CARD_FIELDS = {"_id": 0, "id": 1, "name": 1, "display_name": 1, "avatar_url": 1, "picture": 1, "is_veteran": 1, "privacy_level": 1}
+USER_CARDS_MAX_IDS = 200
+
+class UserCardCache:
+    """LRU of projected user documents for public cards.
+
+    Entries are dropped by update_profile on this worker and expire after `ttl_seconds`
+    so edits made through other workers show up too. Unknown IDs (e.g. anonymous
+    authors) are cached as misses.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # user_id -> (cached_at, doc or None)
+
+    async def get_many(self, user_ids: List[str]) -> Dict[str, Optional[dict]]:
+        now = time.monotonic()
+        found, missing = {}, []
+        for user_id in user_ids:
+            entry = self.entries.get(user_id)
+            if entry and now - entry[0] < self.ttl_seconds:
+                self.entries.move_to_end(user_id)
+                found[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+        
+        if missing:
+            docs = await db.users.find({"id": {"$in": missing}}, USER_CARD_FIELDS).to_list(length=None)
+            by_id = {doc["id"]: doc for doc in docs}
+            for user_id in missing:
+                found[user_id] = by_id.get(user_id)
+                self.entries[user_id] = (now, found[user_id])
+                self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return found
+
+    def invalidate(self, user_id: str):
+        self.entries.pop(user_id, None)
+
+user_cards = UserCardCache(
+    max_size=int(os.environ.get('USER_CARD_CACHE_SIZE', '10000')),
+    ttl_seconds=float(os.environ.get('USER_CARD_CACHE_TTL_SECONDS', '300'))
+)
+
+def build_user_card(user_id: str, doc: Optional[dict], viewer: Optional[User]) -> dict:
+    """Public card for a user - private profiles (and community profiles for signed-out viewers) stay hidden"""
+    level = doc.get("privacy_level", "private") if doc else "private"
+    visible = level == "public" or (level == "community" and viewer is not None) or (viewer is not None and viewer.id == user_id)
+    if not doc or not visible:
+        return {"id": user_id, "display_name": f"Member{user_id[-4:]}", "avatar_url": None, "is_veteran": False}
+    return {
+        "id": user_id,
+        "display_name": doc.get("display_name") or doc.get("name"),
+        "avatar_url": doc.get("avatar_url") or doc.get("picture"),
+        "is_veteran": doc.get("is_veteran", False)
+    }
+
+@api_router.post("/users/cards")
+async def get_user_cards(cards_request: UserCardsRequest, request: Request):
+    """Minimal public cards (name, avatar, veteran badge) for many users in one call"""
+    user_ids = list(dict.fromkeys(cards_request.ids))
+    if len(user_ids) > USER_CARDS_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {USER_CARDS_MAX_IDS} ids per request")
+    
+    viewer, docs = await asyncio.gather(get_current_user(request), user_cards.get_many(user_ids))
+    return {"cards": {user_id: build_user_card(user_id, docs.get(user_id), viewer) for user_id in user_ids}}
+
 # Health endpoints for basic checks
 @api_router.get("/")
 async def root():
@@ -731,6 +3002,27 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat(), "monitoring": "active"}
 
+@api_router.get("/ready")
+async def readiness_check():
+    """Readiness - the API stays ready while the LLM is degraded, since every AI path has a fallback"""
+    breaker = llm_breaker.snapshot()
+    return {
+        "status": "ready",
+        "llm": "degraded" if breaker["state"] != "closed" else "ok",
+        "llm_breaker": breaker["state"],
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Operational metrics snapshot"""
+    return {
+        "llm_breaker": llm_breaker.snapshot(),
+        "llm_scheduler": llm_scheduler.snapshot(),
+        "llm_timeouts": llm_timeouts.snapshot(),
+        "event_loop": loop_watchdog.snapshot()
+    }
+
 @api_router.get("/contact-info")
 async def get_contact_info():
     return {
@@ -855,18 +3147,204 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging - records are queued from the event loop and written by a background thread
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+session_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("session_id", default=None)
+
+class CorrelationFilter(logging.Filter):
+    """Stamp records with the request and session IDs of the code that logged them"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most `burst` identical warnings/errors per `window` seconds.
+
+    Suppressed repeats are counted and reported on the next record that gets through.
+    """
+
+    def __init__(self, burst: int = 5, window: float = 60.0, max_keys: int = 1000):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.max_keys = max_keys
+        self.seen: "OrderedDict[tuple, list]" = OrderedDict()  # key -> [window_start, count, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.levelno, record.pathname, record.lineno, record.getMessage())
+        now = time.monotonic()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                suppressed = entry[2] if entry else 0
+                self.seen[key] = [now, 1, 0]
+                self.seen.move_to_end(key)
+                while len(self.seen) > self.max_keys:
+                    self.seen.popitem(last=False)
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            entry[1] += 1
+            if entry[1] <= self.burst:
+                return True
+            entry[2] += 1
+            return False
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "session_id": getattr(record, "session_id", None)
+        }
+        if getattr(record, "suppressed", None):
+            entry["suppressed_repeats"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps the traceback in `exc_text` instead of folding it into the message"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() formats the traceback into msg and clears exc_info, so the
+        # listener's formatter would never see the exception
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def configure_logging() -> logging.handlers.QueueListener:
+    """Route all logging through a queue so log calls never do I/O on the event loop"""
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(
+        burst=int(os.environ.get('LOG_RATE_LIMIT_BURST', '5')),
+        window=float(os.environ.get('LOG_RATE_LIMIT_WINDOW_SECONDS', '60'))
+    ))
+    queue_handler.addFilter(CorrelationFilter())
+    
+    stream_handler = logging.StreamHandler()
+    if os.environ.get('LOG_FORMAT', 'json') == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'))
+    
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
 
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """Open the root span for sampled requests"""
+    root = tracer.start_trace(
+        f"{request.method} {request.url.path}",
+        traceparent=request.headers.get("traceparent"),
+        **{"http.method": request.method, "http.target": request.url.path}
+    )
+    if root is None:
+        return await call_next(request)
+    
+    token = current_span_var.set(root)
+    try:
+        response = await call_next(request)
+    except BaseException as e:
+        current_span_var.reset(token)
+        tracer.finish(root, e)
+        raise
+    current_span_var.reset(token)
+    root.attributes["http.status_code"] = response.status_code
+    tracer.finish(root)
+    response.headers["traceparent"] = f"00-{root.trace['trace_id']}-{root.span_id}-01"
+    return response
+
+@app.middleware("http")
+async def correlation_id_middleware(request: Request, call_next):
+    """Assign a request ID (or honour X-Request-ID) and a session correlation ID to the request's logs"""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    session_token = request.cookies.get("session_token")
+    request_token = request_id_var.set(request_id)
+    session_token_var = session_id_var.set(hashlib.sha256(session_token.encode()).hexdigest()[:12] if session_token else None)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(request_token)
+        session_id_var.reset(session_token_var)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 @app.on_event("startup")
 async def startup_event():
     await setup_default_communities()
+    if chat_sequences.block_size > 1:
+        logger.warning("CHAT_SEQ_BLOCK_SIZE=%d - chat sequences are only gap-free with a single worker", chat_sequences.block_size)
+    if CHAT_STORAGE != 'buckets':
+        await db.live_chat.create_index([("community_id", 1), ("seq", 1)])
+        await db.live_chat.create_index([("community_id", 1), ("created_at", 1)])
+    if CHAT_STORAGE != 'messages':
+        await db.live_chat_buckets.create_index([("community_id", 1), ("bucket", 1)])
+        await db.live_chat_buckets.create_index([("community_id", 1), ("last_at", 1)])
+    await db.posts.create_index([("community_id", 1), ("updated_at", 1)])
+    await db.communities.create_index("updated_at")
+    await backfill_updated_at()
+    await db.read_markers.create_index("user_id")
+    await db.replies.create_index([("post_id", 1), ("path", 1)])
+    await db.replies.create_index("id")
+    await db.reactions.create_index([("target_type", 1), ("target_id", 1), ("user_id", 1), ("reaction", 1)], unique=True)
+    await db.posts.create_index("id")
+    if CHAT_STORAGE != 'buckets':
+        await db.live_chat.create_index("id")
+    if CHAT_STORAGE != 'messages':
+        await db.live_chat_buckets.create_index("messages.id")
+    await db.community_members.create_index("user_id")
+    await db.community_members.create_index("community_id")
+    if post_search_index is not None:
+        await build_post_search_index()
+    else:
+        await db.posts.create_index(
+            [("title", "text"), ("content", "text")],
+            weights={"title": 3, "content": 1},
+            name="posts_text"
+        )
+    if os.environ.get('LOOP_WATCHDOG_ENABLED', 'true').lower() == 'true':
+        loop_watchdog.start(asyncio.get_running_loop())
+    community_counters.start()
+    read_markers.start()
+    reaction_buffer.start()
+    await db.activity_scores.create_index("expires_at", expireAfterSeconds=0)
+    activity_ranking.start()
+    await db.presence.create_index("expires_at", expireAfterSeconds=0)
+    presence.start()
+    app.state.typing_task = asyncio.create_task(broadcast_typing())
     logger.info("Circle of Care API started - 24/7 monitoring active")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    loop_watchdog.stop()
+    await community_counters.stop()
+    await read_markers.stop()
+    await reaction_buffer.stop()
+    await activity_ranking.stop()
+    await presence.stop()
+    app.state.typing_task.cancel()
+    log_listener.stop()
     client.close()
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""
+Typing indicators for live chat rooms.
+
+Clients report typing on every keystroke or so; the tracker drops reports that arrive
+within the debounce window of a user's previous one, expires users who stop sending
+them, and tells the caller which rooms changed since the last flush so each room gets
+at most one aggregate "who's typing" frame per flush interval, however many people
+are typing or how fast.
+"""
+
+from typing import Dict, List, Tuple
+
+class TypingTracker:
+    """Per-room typists with debounced updates and expiry, flushed as one aggregate per room"""
+
+    def __init__(self, ttl: float = 5.0, debounce: float = 1.0, max_names: int = 5):
+        self.ttl = ttl
+        self.debounce = debounce
+        self.max_names = max_names
+        self.rooms: Dict[str, Dict[str, list]] = {}  # community_id -> user_id -> [user_name, expires_at, last_seen]
+        self.dirty: set = set()
+        self.accepted = 0
+        self.dropped = 0
+
+    def typing(self, community_id: str, user_id: str, user_name: str, now: float) -> bool:
+        """Record a typing report; returns False when it was debounced"""
+        room = self.rooms.setdefault(community_id, {})
+        entry = room.get(user_id)
+        if entry is not None and now - entry[2] < self.debounce:
+            self.dropped += 1
+            return False
+
+        self.accepted += 1
+        if entry is None or entry[0] != user_name:
+            self.dirty.add(community_id)
+        room[user_id] = [user_name, now + self.ttl, now]
+        return True
+
+    def stopped(self, community_id: str, user_id: str):
+        """Clear a user's indicator, e.g. once they send the message or disconnect"""
+        room = self.rooms.get(community_id)
+        if room and room.pop(user_id, None) is not None:
+            self.dirty.add(community_id)
+            if not room:
+                del self.rooms[community_id]
+
+    def flush(self, now: float) -> Dict[str, Tuple[List[str], int]]:
+        """Expire stale typists and return (names, count) for every room that changed"""
+        for community_id, room in list(self.rooms.items()):
+            expired = [user_id for user_id, entry in room.items() if entry[1] <= now]
+            for user_id in expired:
+                del room[user_id]
+            if expired:
+                self.dirty.add(community_id)
+            if not room:
+                del self.rooms[community_id]
+
+        changes = {}
+        for community_id in self.dirty:
+            room = self.rooms.get(community_id, {})
+            names = sorted(entry[0] for entry in room.values())[:self.max_names]
+            changes[community_id] = (names, len(room))
+        self.dirty = set()
+        return changes
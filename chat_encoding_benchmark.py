@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Circle of Care - Live Chat Frame Encoding Benchmark
+Reports bytes per message and broadcast CPU for each WebSocket frame encoding
+"""
+
+import json
+import random
+import string
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ROOM_SIZES = [10, 100, 1000]
+MESSAGES = 2000
+
+def sample_message(seq: int) -> dict:
+    """Build a chat frame shaped like the server's serialized live chat messages"""
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(2, 9))) for _ in range(random.randint(3, 30))]
+    return {
+        "id": str(uuid.uuid4()),
+        "user_name": f"Anonymous{uuid.uuid4().hex[:4]}",
+        "message": " ".join(words),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "seq": seq,
+        "type": "message"
+    }
+
+def encoders() -> dict:
+    result = {"json": lambda message: json.dumps(message, separators=(",", ":")).encode()}
+    if msgpack is not None:
+        result["msgpack"] = lambda message: msgpack.packb(message, use_bin_type=True)
+    return result
+
+def deflated_size(frames: list) -> float:
+    """Average frame size with permessage-deflate (raw deflate, shared context, as negotiated by default)"""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    total = 0
+    for frame in frames:
+        data = compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        total += len(data) - 4  # the trailing 00 00 ff ff is stripped on the wire
+    return total / len(frames)
+
+def broadcast_cpu(encode, messages: list, recipients: int, encode_once: bool) -> float:
+    """CPU seconds spent encoding frames for one broadcast per message"""
+    start = time.process_time()
+    for message in messages:
+        if encode_once:
+            frame = encode(message)
+            for _ in range(recipients):
+                payload = frame
+        else:
+            for _ in range(recipients):
+                payload = encode(message)
+    return time.process_time() - start
+
+def main():
+    random.seed(42)
+    messages = [sample_message(seq) for seq in range(1, MESSAGES + 1)]
+
+    print("🚀 Live chat frame encoding benchmark")
+    print(f"📦 {MESSAGES} messages, room sizes {ROOM_SIZES}")
+    if msgpack is None:
+        print("⚠️  msgpack not installed - only JSON will be measured")
+    print("=" * 80)
+
+    print(f"{'encoding':<10} {'bytes/msg':>10} {'deflate bytes/msg':>18}")
+    for name, encode in encoders().items():
+        frames = [encode(message) for message in messages]
+        raw = sum(len(frame) for frame in frames) / len(frames)
+        print(f"{name:<10} {raw:>10.1f} {deflated_size(frames):>18.1f}")
+
+    print()
+    print(f"{'encoding':<10} {'recipients':>10} {'per-recipient ms':>17} {'encode-once ms':>15}")
+    for name, encode in encoders().items():
+        for recipients in ROOM_SIZES:
+            sample = messages[:max(1, MESSAGES // recipients)]
+            naive = broadcast_cpu(encode, sample, recipients, encode_once=False) * 1000 / len(sample)
+            shared = broadcast_cpu(encode, sample, recipients, encode_once=True) * 1000 / len(sample)
+            print(f"{name:<10} {recipients:>10} {naive:>17.3f} {shared:>15.3f}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
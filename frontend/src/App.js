@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import "./App.css";
 import { BrowserRouter, Routes, Route } from "react-router-dom";
 import axios from "axios";
@@ -531,6 +531,7 @@ const Dashboard = () => {
   const [showCreatePost, setShowCreatePost] = useState(false);
   const [newPostTitle, setNewPostTitle] = useState("");
   const [newPostContent, setNewPostContent] = useState("");
+  const [unreadCounts, setUnreadCounts] = useState({});
 
   // Handle Emergent Auth session
   useEffect(() => {
@@ -551,12 +552,13 @@ const Dashboard = () => {
           console.error('Auth error:', error);
         }
       } else {
-        // Check existing session
+        // Check existing session and load the community list in the same round trip
         try {
-          const response = await axios.get(`${API}/auth/me`, {
+          const response = await axios.get(`${API}/bootstrap?sort=active`, {
             withCredentials: true
           });
-          setUser(response.data);
+          setCommunities(response.data.communities || []);
+          setUser(response.data.user);
         } catch (error) {
           // Not authenticated, redirect to website
           window.location.href = '/';
@@ -572,7 +574,7 @@ const Dashboard = () => {
   useEffect(() => {
     const loadCommunities = async () => {
       try {
-        const response = await axios.get(`${API}/communities`, {
+        const response = await axios.get(`${API}/communities?sort=active`, {
           withCredentials: true
         });
         setCommunities(response.data);
@@ -581,44 +583,88 @@ const Dashboard = () => {
       }
     };
 
-    if (user) {
+    if (user && communities.length === 0) {
       loadCommunities();
     }
   }, [user]);
 
+  // Load unread counts for all of the user's communities in one request
+  useEffect(() => {
+    const loadUnreadCounts = async () => {
+      try {
+        const response = await axios.get(`${API}/unread`, {
+          withCredentials: true
+        });
+        setUnreadCounts(response.data);
+      } catch (error) {
+        console.error('Error loading unread counts:', error);
+      }
+    };
+
+    if (user) {
+      loadUnreadCounts();
+    }
+  }, [user]);
+
   // HTTP-based chat system (more reliable than WebSocket)
   const [chatPollingInterval, setChatPollingInterval] = useState(null);
+  const chatPollerRef = useRef(null);
 
   const startChatPolling = (communityId) => {
     // Stop any existing polling
-    if (chatPollingInterval) {
-      clearInterval(chatPollingInterval);
-    }
+    stopChatPolling();
 
-    // Load initial messages
-    loadChatMessages(communityId);
+    // Long-poll for new messages - the server holds each request until a message arrives
+    const poller = { active: true };
+    chatPollerRef.current = poller;
+    setChatPollingInterval(poller);
 
-    // Set up polling for new messages
-    const interval = setInterval(() => {
-      loadChatMessages(communityId);
-    }, 3000); // Poll every 3 seconds
+    const poll = async () => {
+      // Load initial messages
+      let lastSeq = await loadChatMessages(communityId);
 
-    setChatPollingInterval(interval);
+      while (poller.active) {
+        try {
+          const response = await axios.get(`${API}/chat/${communityId}/poll`, {
+            params: { after_seq: lastSeq, timeout: 25 }
+          });
+          if (!poller.active) break;
+
+          const newMessages = response.data.messages || [];
+          if (newMessages.length > 0) {
+            setLiveChatHistory(prev => {
+              const seen = new Set(prev.map(msg => msg.id));
+              return [...prev, ...newMessages.filter(msg => !seen.has(msg.id))].slice(-20);
+            });
+          }
+          lastSeq = response.data.last_seq;
+        } catch (error) {
+          console.error('Error polling chat messages:', error);
+          await new Promise(resolve => setTimeout(resolve, 3000));
+        }
+      }
+    };
+
+    poll();
   };
 
   const stopChatPolling = () => {
-    if (chatPollingInterval) {
-      clearInterval(chatPollingInterval);
-      setChatPollingInterval(null);
+    if (chatPollerRef.current) {
+      chatPollerRef.current.active = false;
+      chatPollerRef.current = null;
     }
+    setChatPollingInterval(null);
   };
 
   const loadChatMessages = async (communityId) => {
     try {
       const response = await axios.get(`${API}/chat/${communityId}/messages?limit=20`);
-      setLiveChatHistory(response.data || []);
+      const messages = response.data || [];
+      setLiveChatHistory(messages);
+      return messages.reduce((max, msg) => Math.max(max, msg.seq || 0), 0);
     } catch (error) {
       console.error('Error loading chat messages:', error);
+      return 0;
     }
   };
 
@@ -635,9 +681,6 @@ const Dashboard = () => {
       await axios.post(`${API}/chat/${selectedCommunity.id}/send`, messageData);
       setLiveChatMessage("");
       
-      // Immediately refresh messages
-      loadChatMessages(selectedCommunity.id);
-      
     } catch (error) {
       console.error('Error sending message:', error);
       if (error.response?.data?.detail) {
@@ -648,6 +691,10 @@ const Dashboard = () => {
 
   const handleCommunitySelect = async (community) => {
     setSelectedCommunity(community);
+    setUnreadCounts(counts => ({ ...counts, [community.id]: { ...counts[community.id], total: 0 } }));
+    axios.post(`${API}/communities/${community.id}/read`, null, {
+      withCredentials: true
+    }).catch(error => console.error('Error marking community read:', error));
     try {
       const response = await axios.get(`${API}/communities/${community.id}/posts`, {
         withCredentials: true
@@ -665,6 +712,21 @@ const Dashboard = () => {
 
   const sendLiveChatMessage = sendChatMessage;
 
+  const sendHug = async (post) => {
+    try {
+      const response = await axios.post(`${API}/reactions`, {
+        target_type: "post",
+        target_id: post.id,
+        reaction: "hug"
+      }, { withCredentials: true });
+      setPosts(current => current.map(p => p.id === post.id
+        ? { ...p, reactions: response.data.reactions }
+        : p));
+    } catch (error) {
+      console.error('Error sending hug:', error);
+    }
+  };
+
   const createNewPost = async () => {
     if (!selectedCommunity || !newPostTitle.trim() || !newPostContent.trim()) {
       return;
@@ -853,8 +915,18 @@ const Dashboard = () => {
                     className="w-full justify-start text-left h-auto p-3"
                   >
                     <div>
-                      <div className="font-medium">{community.name}</div>
+                      <div className="font-medium">
+                        {community.name}
+                        {unreadCounts[community.id]?.total > 0 && (
+                          <Badge className="ml-2" data-testid={`community-unread-${community.category}`}>
+                            {unreadCounts[community.id].total}
+                          </Badge>
+                        )}
+                      </div>
                       <div className="text-xs text-slate-500 mt-1">{community.description}</div>
+                      <div className="text-xs text-slate-400 mt-1" data-testid={`community-stats-${community.category}`}>
+                        {community.member_count || 0} members · {community.post_count || 0} posts · {community.messages_today || 0} messages today
+                      </div>
                     </div>
                   </Button>
                 ))}
@@ -1000,7 +1072,18 @@ const Dashboard = () => {
                             <p className="text-slate-600 mt-2">{post.content}</p>
                             <div className="flex items-center justify-between mt-3">
                               <Badge variant="outline">{post.support_type}</Badge>
-                              <span className="text-xs text-slate-400">{new Date(post.created_at).toLocaleDateString()}</span>
+                              <div className="flex items-center space-x-3">
+                                <Button
+                                  variant="ghost"
+                                  size="sm"
+                                  onClick={() => sendHug(post)}
+                                  data-testid={`hug-post-${post.id}`}
+                                >
+                                  <Heart className="h-4 w-4 mr-1" />
+                                  {post.reactions?.hug || 0}
+                                </Button>
+                                <span className="text-xs text-slate-400">{new Date(post.created_at).toLocaleDateString()}</span>
+                              </div>
                             </div>
                           </CardContent>
                         </Card>
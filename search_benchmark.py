@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Circle of Care - Post Search Benchmark
+Builds the in-process post search index over synthetic posts and reports
+query latency percentiles and index memory use
+
+Usage: python search_benchmark.py [post_count] [query_count]
+"""
+
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from post_search import PostSearchIndex
+
+VOCABULARY_SIZE = 20000
+COMMUNITIES = [str(uuid.uuid4()) for _ in range(50)]
+SUPPORT_TYPES = ["general", "seeking-help", "offering-support", "milestone"]
+
+def rss_bytes() -> int:
+    """Resident set size of this process (Linux)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+def make_vocabulary() -> list:
+    rng = random.Random(7)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(VOCABULARY_SIZE)]
+
+def zipf_cumulative_weights(size: int) -> list:
+    total, cumulative = 0.0, []
+    for rank in range(size):
+        total += 1.0 / (rank + 1)
+        cumulative.append(total)
+    return cumulative
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def main():
+    post_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rng = random.Random(42)
+    vocabulary = make_vocabulary()
+    cum_weights = zipf_cumulative_weights(len(vocabulary))
+
+    print("🚀 Post search benchmark")
+    print(f"📦 {post_count:,} synthetic posts, {query_count:,} queries")
+    print("=" * 80)
+
+    index = PostSearchIndex()
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    for i in range(post_count):
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=45)
+        index.add({
+            "id": str(uuid.uuid4()),
+            "community_id": COMMUNITIES[i % len(COMMUNITIES)],
+            "support_type": SUPPORT_TYPES[i % len(SUPPORT_TYPES)],
+            "title": " ".join(words[:5]),
+            "content": " ".join(words[5:])
+        })
+    build_seconds = time.perf_counter() - start
+    rss_after = rss_bytes()
+
+    print(f"⏱️  Build: {build_seconds:.1f}s ({post_count / build_seconds:,.0f} posts/s)")
+    print(f"💾 Index arrays: {index.memory_bytes() / 2**20:,.1f} MiB, process RSS growth: {(rss_after - rss_before) / 2**20:,.1f} MiB")
+    print(f"📚 Terms: {len(index.postings):,}")
+
+    # Queries skew towards mid-frequency terms; very common terms are the worst case
+    query_terms = vocabulary[20:5000]
+    scenarios = {
+        "1 term": lambda: (" ".join(rng.sample(query_terms, 1)), None),
+        "2 terms": lambda: (" ".join(rng.sample(query_terms, 2)), None),
+        "3 terms + community": lambda: (" ".join(rng.sample(query_terms, 3)), rng.choice(COMMUNITIES)),
+        "common term": lambda: (vocabulary[rng.randint(0, 19)], None),
+    }
+    print()
+    print(f"{'scenario':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, make_query in scenarios.items():
+        latencies = []
+        for _ in range(query_count if name != "common term" else max(1, query_count // 10)):
+            query, community_id = make_query()
+            start = time.perf_counter()
+            index.search(query, community_id=community_id, limit=20)
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"{name:<22} {percentile(latencies, 0.5):>8.2f} {percentile(latencies, 0.95):>8.2f} {percentile(latencies, 0.99):>8.2f}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from chat_storage import ChatBucketStore, SequenceAllocator
+
+
+class CounterCollection:
+    """Just enough of a Motor collection for SequenceAllocator"""
+
+    def __init__(self):
+        self.values = {}
+        self.calls = 0
+
+    async def find_one_and_update(self, query, update, upsert, return_document):
+        self.calls += 1
+        await asyncio.sleep(0)
+        key = query["_id"]
+        self.values[key] = self.values.get(key, 0) + update["$inc"]["value"]
+        return {"_id": key, "value": self.values[key]}
+
+
+def test_sequence_allocator_is_monotonic_under_concurrency():
+    collection = CounterCollection()
+    allocator = SequenceAllocator(collection, block_size=10)
+
+    async def scenario():
+        return await asyncio.gather(*(allocator.next("room") for _ in range(35)))
+
+    seqs = asyncio.run(scenario())
+    assert sorted(seqs) == list(range(1, 36))
+    assert collection.calls == 4
+
+
+def test_sequence_allocator_workers_share_one_sequence():
+    collection = CounterCollection()
+    workers = [SequenceAllocator(collection), SequenceAllocator(collection)]
+
+    async def scenario():
+        return [await workers[index % 2].next("room") for index in range(6)]
+
+    assert asyncio.run(scenario()) == [1, 2, 3, 4, 5, 6]
+
+
+def test_sequence_allocator_keys_are_independent():
+    allocator = SequenceAllocator(CounterCollection(), block_size=5)
+
+    async def scenario():
+        return [await allocator.next(key) for key in ("a", "b", "a", "b", "a")]
+
+    assert asyncio.run(scenario()) == [1, 1, 2, 2, 3]
+
+
+def test_sequence_allocator_never_repeats_after_restart():
+    collection = CounterCollection()
+
+    async def scenario():
+        first = SequenceAllocator(collection, block_size=10)
+        before = [await first.next("room") for _ in range(3)]
+        restarted = SequenceAllocator(collection, block_size=10)
+        after = [await restarted.next("room") for _ in range(3)]
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before == [1, 2, 3]
+    assert after == [11, 12, 13]
+
+
+# ChatBucketStore
+
+def message(community_id, seq, at):
+    return {
+        "id": f"{community_id}-{seq}",
+        "community_id": community_id,
+        "user_id": "user_1234",
+        "user_name": "Sam",
+        "message": f"message {seq}",
+        "is_anonymous": False,
+        "seq": seq,
+        "created_at": at.isoformat()
+    }
+
+
+@pytest.fixture
+def store():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return ChatBucketStore(mongomock_motor.AsyncMongoMockClient()["test"].live_chat_buckets, size=5)
+
+
+def fill(store, community_id, count):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    async def scenario():
+        for seq in range(1, count + 1):
+            await store.append(message(community_id, seq, start + timedelta(seconds=seq)))
+
+    asyncio.run(scenario())
+
+
+def test_bucket_store_latest_spans_buckets_in_order(store):
+    fill(store, "room", 23)
+    fill(store, "other", 4)
+
+    latest = asyncio.run(store.latest("room", 7))
+    assert [msg["seq"] for msg in latest] == list(range(17, 24))
+    assert [msg["seq"] for msg in asyncio.run(store.latest("room", 50))] == list(range(1, 24))
+    assert asyncio.run(store.latest("room", 0)) == []
+    assert asyncio.run(store.latest("empty", 5)) == []
+
+
+def test_bucket_store_since_returns_newer_messages_up_to_limit(store):
+    fill(store, "room", 23)
+
+    assert [msg["seq"] for msg in asyncio.run(store.since("room", 9, 100))] == list(range(10, 24))
+    assert [msg["seq"] for msg in asyncio.run(store.since("room", 9, 3))] == [10, 11, 12]
+    assert asyncio.run(store.since("room", 23, 10)) == []
+
+
+def test_bucket_store_ignores_repeated_appends(store):
+    fill(store, "room", 3)
+    at = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=2)
+    asyncio.run(store.append(message("room", 2, at)))
+
+    assert [msg["seq"] for msg in asyncio.run(store.latest("room", 10))] == [1, 2, 3]
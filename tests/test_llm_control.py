@@ -0,0 +1,205 @@
+import asyncio
+import time
+
+import pytest
+
+import llm_control
+from llm_control import CircuitBreaker, LLMDeadlineExceeded, LLMScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(llm_control, "time", fake)
+    return fake
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def deadline(seconds=10.0):
+    return time.monotonic() + seconds
+
+
+# CircuitBreaker
+
+def open_breaker(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.record(False, 0.1)
+    assert breaker.state == "open"
+
+
+def test_breaker_opens_on_error_rate_and_rejects(clock):
+    breaker = CircuitBreaker(min_calls=4, error_rate=0.5, cooldown_seconds=30)
+    breaker.record(True, 0.1)
+    breaker.record(True, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.state == "closed"
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.snapshot()["rejected_calls"] == 1
+
+
+def test_breaker_opens_on_slow_call_rate(clock):
+    breaker = CircuitBreaker(min_calls=2, slow_call_seconds=5, slow_rate=0.5)
+    breaker.record(True, 6.0)
+    breaker.record(True, 6.0)
+    assert breaker.state == "open"
+
+
+def test_breaker_judges_slowness_against_the_callers_threshold(clock):
+    breaker = CircuitBreaker(min_calls=2, slow_call_seconds=5, slow_rate=0.5)
+    # Long but within a 40s budget - a companion reply, not a sick provider
+    breaker.record(True, 20.0, slow_call_seconds=32.0)
+    breaker.record(True, 20.0, slow_call_seconds=32.0)
+    assert breaker.state == "closed"
+    breaker.record(True, 3.0, slow_call_seconds=2.4)
+    breaker.record(True, 3.0, slow_call_seconds=2.4)
+    assert breaker.state == "open"
+
+
+def test_breaker_half_open_limits_trials_and_closes_on_success(clock):
+    breaker = CircuitBreaker(min_calls=2, cooldown_seconds=30, half_open_max_calls=2)
+    open_breaker(breaker)
+    clock.now += 29
+    assert not breaker.allow()
+
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record(True, 0.1)
+    assert breaker.state == "closed"
+    assert breaker.snapshot()["window_calls"] == 0
+    assert breaker.allow()
+
+
+@pytest.mark.parametrize("ok, latency", [(False, 0.1), (True, 9.0)])
+def test_breaker_failed_or_slow_trial_reopens(clock, ok, latency):
+    breaker = CircuitBreaker(min_calls=2, slow_call_seconds=8, cooldown_seconds=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.record(ok, latency)
+    assert breaker.state == "open"
+    assert breaker.times_opened == 2
+    clock.now += 29
+    assert not breaker.allow()
+
+
+def test_breaker_release_returns_a_trial_slot(clock):
+    breaker = CircuitBreaker(min_calls=2, cooldown_seconds=30, half_open_max_calls=1)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+# LLMScheduler
+
+def test_scheduler_serves_highest_priority_first():
+    async def scenario():
+        scheduler = LLMScheduler(1, {"panic": 1, "companion": 1, "moderation": 1}, min_call_seconds=0)
+        await scheduler.acquire("companion", "holder", deadline())
+        order = []
+
+        async def call(priority, user_id):
+            await scheduler.acquire(priority, user_id, deadline())
+            order.append(priority)
+
+        tasks = [asyncio.create_task(call(priority, "u")) for priority in ("moderation", "companion", "panic")]
+        await settle()
+        assert order == []
+
+        for running in ("companion", "panic", "companion"):
+            scheduler.release(running)
+            await settle()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["panic", "companion", "moderation"]
+
+
+def test_scheduler_class_limit_leaves_headroom_for_panic():
+    async def scenario():
+        scheduler = LLMScheduler(4, {"panic": 4, "companion": 3, "moderation": 1}, min_call_seconds=0)
+        await scheduler.acquire("moderation", "a", deadline())
+        queued = asyncio.create_task(scheduler.acquire("moderation", "b", deadline()))
+        await settle()
+        assert not queued.done()
+
+        await asyncio.wait_for(scheduler.acquire("panic", "c", deadline()), timeout=1)
+        scheduler.release("moderation")
+        await asyncio.wait_for(queued, timeout=1)
+        return scheduler.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["moderation"]["running"] == 1
+    assert snapshot["moderation"]["dispatched"] == 2
+    assert snapshot["panic"]["running"] == 1
+
+
+def test_scheduler_round_robins_users_within_a_class():
+    async def scenario():
+        scheduler = LLMScheduler(1, {"panic": 1, "companion": 1, "moderation": 1}, min_call_seconds=0)
+        await scheduler.acquire("companion", "holder", deadline())
+        order = []
+
+        async def call(user_id):
+            await scheduler.acquire("companion", user_id, deadline())
+            order.append(user_id)
+
+        tasks = [asyncio.create_task(call(user_id)) for user_id in ("busy", "busy", "busy", "other")]
+        await settle()
+        for _ in tasks:
+            scheduler.release("companion")
+            await settle()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["busy", "other", "busy", "busy"]
+
+
+def test_scheduler_drops_work_whose_deadline_is_too_close():
+    async def scenario():
+        scheduler = LLMScheduler(1, {"panic": 1, "companion": 1, "moderation": 1}, min_call_seconds=1.0)
+        await scheduler.acquire("companion", "holder", deadline())
+        doomed = asyncio.create_task(scheduler.acquire("companion", "u", deadline(1.2)))
+        await asyncio.sleep(0.3)
+        scheduler.release("companion")
+        with pytest.raises(LLMDeadlineExceeded):
+            await doomed
+        return scheduler.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["companion"]["dropped"] == 1
+    assert snapshot["companion"]["running"] == 0
+
+
+def test_scheduler_times_out_work_still_queued_at_its_deadline():
+    async def scenario():
+        scheduler = LLMScheduler(1, {"panic": 1, "companion": 1, "moderation": 1}, min_call_seconds=0)
+        await scheduler.acquire("companion", "holder", deadline())
+        with pytest.raises(LLMDeadlineExceeded):
+            await scheduler.acquire("companion", "u", deadline(0.05))
+        return scheduler.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["companion"]["dropped"] == 1
+    assert snapshot["companion"]["queued"] == 0
@@ -0,0 +1,47 @@
+from typing_indicators import TypingTracker
+
+
+def test_reports_within_debounce_window_are_dropped():
+    tracker = TypingTracker(ttl=5.0, debounce=1.0)
+    assert tracker.typing("room", "u1", "Sam", now=0.0)
+    assert not tracker.typing("room", "u1", "Sam", now=0.5)
+    assert tracker.typing("room", "u1", "Sam", now=1.0)
+    assert (tracker.accepted, tracker.dropped) == (2, 1)
+
+
+def test_flush_reports_only_changed_rooms():
+    tracker = TypingTracker(ttl=5.0, debounce=1.0)
+    tracker.typing("room", "u1", "Sam", now=0.0)
+    tracker.typing("room", "u2", "Alex", now=0.0)
+    assert tracker.flush(now=0.1) == {"room": (["Alex", "Sam"], 2)}
+
+    # A repeat report only extends the expiry - nothing to broadcast
+    tracker.typing("room", "u1", "Sam", now=2.0)
+    assert tracker.flush(now=2.1) == {}
+
+
+def test_typists_expire_after_ttl():
+    tracker = TypingTracker(ttl=5.0, debounce=1.0)
+    tracker.typing("room", "u1", "Sam", now=0.0)
+    tracker.typing("room", "u2", "Alex", now=3.0)
+    tracker.flush(now=3.0)
+
+    assert tracker.flush(now=5.0) == {"room": (["Alex"], 1)}
+    assert tracker.flush(now=8.0) == {"room": ([], 0)}
+    assert tracker.rooms == {}
+
+
+def test_stopped_clears_indicator():
+    tracker = TypingTracker()
+    tracker.typing("room", "u1", "Sam", now=0.0)
+    tracker.flush(now=0.0)
+    tracker.stopped("room", "u1")
+    tracker.stopped("room", "unknown")
+    assert tracker.flush(now=0.1) == {"room": ([], 0)}
+
+
+def test_names_are_capped_but_count_is_total():
+    tracker = TypingTracker(max_names=2)
+    for index, name in enumerate(["Dee", "Cam", "Bo", "Al"]):
+        tracker.typing("room", f"u{index}", name, now=0.0)
+    assert tracker.flush(now=0.0) == {"room": (["Al", "Bo"], 4)}
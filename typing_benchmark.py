@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Circle of Care - Typing Indicator Benchmark
+Simulates rooms full of typing members and compares the frames a naive per-keystroke
+broadcast would send with the debounced, aggregated frames the server sends
+
+Usage: python typing_benchmark.py [seconds]
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from typing_indicators import TypingTracker
+
+ROOM_SIZES = [10, 100, 1000, 5000]
+TYPING_SHARE = 0.1  # members composing a message at any moment
+KEYSTROKES_PER_SECOND = 5
+FLUSH_SECONDS = 0.5
+TICK_SECONDS = 0.05
+
+def simulate(room_size: int, seconds: float, rng: random.Random) -> dict:
+    """Drive a TypingTracker on a simulated clock and count frames delivered to members"""
+    tracker = TypingTracker()
+    typists = max(1, int(room_size * TYPING_SHARE))
+    # Each typist types in bursts: a few seconds of keystrokes, then a pause
+    schedule = [[rng.uniform(0, 3), rng.uniform(2, 8)] for _ in range(typists)]  # [burst ends at, next burst at]
+    keystrokes = frames = 0
+    now, next_flush = 0.0, FLUSH_SECONDS
+    while now < seconds:
+        for user, (burst_end, next_burst) in enumerate(schedule):
+            if now >= next_burst:
+                schedule[user] = [now + rng.uniform(2, 6), now + rng.uniform(8, 15)]
+            if now < schedule[user][0] and rng.random() < KEYSTROKES_PER_SECOND * TICK_SECONDS:
+                keystrokes += 1
+                tracker.typing("room", f"user_{user}", f"Member{user}", now)
+        if now >= next_flush:
+            frames += len(tracker.flush(now)) * room_size
+            next_flush += FLUSH_SECONDS
+        now += TICK_SECONDS
+    return {
+        "keystrokes": keystrokes,
+        "naive": keystrokes * (room_size - 1) / seconds,
+        "coalesced": frames / seconds,
+        "per_member": frames / seconds / room_size,
+        "accepted": tracker.accepted,
+    }
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    rng = random.Random(42)
+
+    print("🚀 Typing indicator benchmark")
+    print(f"📦 {seconds:.0f}s simulated, {TYPING_SHARE:.0%} of members typing in bursts at {KEYSTROKES_PER_SECOND} keys/s, flush every {FLUSH_SECONDS}s")
+    print("=" * 80)
+    print(f"{'members':>8} {'keys/s':>8} {'accepted/s':>11} {'naive frames/s':>15} {'coalesced frames/s':>19} {'per member/s':>13}")
+    for room_size in ROOM_SIZES:
+        result = simulate(room_size, seconds, rng)
+        print(f"{room_size:>8} {result['keystrokes'] / seconds:>8.1f} {result['accepted'] / seconds:>11.1f} "
+              f"{result['naive']:>15,.0f} {result['coalesced']:>19,.0f} {result['per_member']:>13.2f}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())